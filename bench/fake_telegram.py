@@ -0,0 +1,112 @@
+import asyncio
+import itertools
+import json
+import random
+import time
+from collections import Counter
+from telegram.request import BaseRequest
+
+BOT_USER = {
+    "id": 100000,
+    "is_bot": True,
+    "first_name": "BenchBot",
+    "username": "bench_bot",
+    "can_join_groups": True,
+    "can_read_all_group_messages": False,
+    "supports_inline_queries": True,
+}
+
+class FakeTelegramRequest(BaseRequest):
+    """Транспорт Bot API без сети: отвечает правдоподобными объектами и умеет отдавать 429."""
+
+    def __init__(self, latency: float = 0.03, error_429_rate: float = 0.0, retry_after: int = 1, seed: int = 0):
+        self.latency = latency
+        self.error_429_rate = error_429_rate
+        self.retry_after = retry_after
+        self.calls = Counter()
+        self.uploaded_bytes = 0
+        self._message_ids = itertools.count(1)
+        self._file_ids = itertools.count(1)
+        self._random = random.Random(seed)
+
+    @property
+    def read_timeout(self):
+        return None
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    def _message(self, chat_id, **extra) -> dict:
+        message = {
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": int(chat_id), "type": "private" if int(chat_id) > 0 else "group"},
+            "from": BOT_USER,
+        }
+        message.update(extra)
+        return message
+
+    def _photo_sizes(self) -> list:
+        file_id = f"AgAC{next(self._file_ids)}"
+        return [
+            {"file_id": f"{file_id}_s", "file_unique_id": f"{file_id}_us", "width": 320, "height": 240},
+            {"file_id": file_id, "file_unique_id": f"{file_id}_u", "width": 1280, "height": 960},
+        ]
+
+    async def _drain_files(self, request_data):
+        # Читаем загружаемые файлы кусками, как это сделал бы настоящий HTTP-клиент
+        for field in (request_data.multipart_data or {}).values():
+            content = field[1]
+            if isinstance(content, bytes):
+                self.uploaded_bytes += len(content)
+                continue
+            while True:
+                chunk = content.read(64 * 1024)
+                if not chunk:
+                    break
+                self.uploaded_bytes += len(chunk)
+                await asyncio.sleep(0)
+
+    def _result(self, method: str, params: dict):
+        chat_id = params.get("chat_id", 1)
+        if method == "getMe":
+            return BOT_USER
+        if method in ("answerCallbackQuery", "answerInlineQuery", "deleteWebhook", "setWebhook", "setMyCommands"):
+            return True
+        if method == "sendPhoto":
+            return self._message(chat_id, photo=self._photo_sizes(), caption=params.get("caption"))
+        if method == "sendMediaGroup":
+            media = params.get("media") or []
+            return [self._message(chat_id, photo=self._photo_sizes(), media_group_id="1") for _ in media]
+        if method == "sendDocument":
+            return self._message(chat_id, document={"file_id": f"BQAC{next(self._file_ids)}",
+                                                    "file_unique_id": "doc", "file_name": "photo.jpg"})
+        if method in ("sendMessage", "editMessageText"):
+            return self._message(chat_id, text=params.get("text", ""))
+        if method == "getUpdates":
+            return []
+        return True
+
+    async def do_request(self, url: str, method: str, request_data=None, read_timeout=None,
+                         write_timeout=None, connect_timeout=None, pool_timeout=None):
+        api_method = url.rsplit("/", 1)[-1]
+        self.calls[api_method] += 1
+        if self.latency:
+            await asyncio.sleep(self._random.expovariate(1 / self.latency))
+        params = request_data.parameters if request_data is not None else {}
+        if api_method.startswith("send") and self._random.random() < self.error_429_rate:
+            self.calls["429"] += 1
+            payload = {
+                "ok": False,
+                "error_code": 429,
+                "description": f"Too Many Requests: retry after {self.retry_after}",
+                "parameters": {"retry_after": self.retry_after},
+            }
+            return 429, json.dumps(payload).encode("utf-8")
+        if request_data is not None and request_data.contains_files:
+            await self._drain_files(request_data)
+        payload = {"ok": True, "result": self._result(api_method, params)}
+        return 200, json.dumps(payload).encode("utf-8")
@@ -0,0 +1,111 @@
+import asyncio
+import itertools
+import json
+import random
+from collections import Counter
+import httpx
+
+IMAGE_HOST = "images.unsplash.test"
+
+class FakeUnsplash:
+    """Имитация api.unsplash.com и CDN картинок для httpx.MockTransport."""
+
+    def __init__(self, latency: float = 0.05, error_rate: float = 0.0, image_size: int = 2 * 1024 * 1024,
+                 total_pages: int = 20, hourly_limit: int = 5000, seed: int = 0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.image_size = image_size
+        self.total_pages = total_pages
+        self.hourly_limit = hourly_limit
+        self.remaining = hourly_limit
+        self.calls = Counter()
+        self._ids = itertools.count(1)
+        self._random = random.Random(seed)
+        self._chunk = bytes(64 * 1024)
+
+    def _photo(self, photo_id: str = None) -> dict:
+        photo_id = photo_id or f"fake{next(self._ids)}"
+        base = f"https://{IMAGE_HOST}/{photo_id}"
+        return {
+            "id": photo_id,
+            "description": f"Фото {photo_id}",
+            "alt_description": None,
+            "urls": {
+                "raw": f"{base}?ixid=raw",
+                "full": f"{base}?q=85&fm=jpg",
+                "regular": f"{base}?w=1080",
+                "small": f"{base}?w=400",
+                "thumb": f"{base}?w=200",
+            },
+            "user": {"name": "Bench Author", "username": "bench"},
+            "links": {"html": base},
+            "exif": {"make": "Fake"},
+        }
+
+    def _json(self, payload, status: int = 200) -> httpx.Response:
+        self.remaining = max(0, self.remaining - 1)
+        headers = {
+            "Content-Type": "application/json",
+            "X-Ratelimit-Limit": str(self.hourly_limit),
+            "X-Ratelimit-Remaining": str(self.remaining),
+        }
+        return httpx.Response(status, headers=headers, content=json.dumps(payload).encode("utf-8"))
+
+    def _image_size(self, request: httpx.Request) -> int:
+        # Динамический ресайз: ~0.3 байта JPEG на пиксель квадрата w*dpr, не больше оригинала
+        width = request.url.params.get("w")
+        if not width or not width.isdigit():
+            return self.image_size
+        dpr = request.url.params.get("dpr", "1")
+        pixels = int(width) * (int(dpr) if dpr.isdigit() else 1)
+        return min(self.image_size, pixels * pixels * 3 // 10)
+
+    async def _image_body(self, size: int):
+        left = size
+        while left > 0:
+            chunk = self._chunk[:min(left, len(self._chunk))]
+            left -= len(chunk)
+            yield chunk
+
+    async def handler(self, request: httpx.Request) -> httpx.Response:
+        path = request.url.path
+        if request.url.host == IMAGE_HOST:
+            endpoint = "image"
+        elif path.startswith("/photos/random"):
+            endpoint = "photos/random"
+        elif path.startswith("/search/photos"):
+            endpoint = "search/photos"
+        else:
+            endpoint = "other"
+        self.calls[endpoint] += 1
+        if self.latency:
+            # Небольшой разброс, чтобы хвосты латентности были похожи на настоящие
+            await asyncio.sleep(self._random.expovariate(1 / self.latency))
+        if self._random.random() < self.error_rate:
+            self.calls[f"{endpoint}:error"] += 1
+            return httpx.Response(503, content=b"Service Unavailable")
+
+        if endpoint == "image":
+            size = self._image_size(request)
+            self.calls["image:bytes"] += size
+            return httpx.Response(
+                200,
+                headers={"Content-Type": "image/jpeg", "Content-Length": str(size)},
+                content=self._image_body(size),
+            )
+        if endpoint == "photos/random":
+            count = request.url.params.get("count")
+            if count:
+                return self._json([self._photo() for _ in range(int(count))])
+            return self._json(self._photo())
+        if endpoint == "search/photos":
+            query = request.url.params.get("query", "")
+            page = int(request.url.params.get("page", 1))
+            per_page = int(request.url.params.get("per_page", 10))
+            results = [self._photo(f"{query}-{page}-{i}".replace(" ", "_")) for i in range(per_page)]
+            return self._json({"total": self.total_pages * per_page, "total_pages": self.total_pages,
+                               "results": results})
+        return httpx.Response(404)
+
+    def transport(self) -> httpx.MockTransport:
+        return httpx.MockTransport(self.handler)
@@ -0,0 +1,233 @@
+"""Нагрузочный прогон обработчиков bot.py без сети.
+
+Запуск из корня репозитория:
+    python -m bench.run --users 200 --concurrency 50
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import os
+import resource
+import sys
+import tempfile
+import time
+from collections import Counter
+
+# Окружение настраиваем до импорта модулей бота: они читают config при импорте
+WORKDIR = tempfile.mkdtemp(prefix="tele-unsplash-bench-")
+os.environ.setdefault("BUFFER_DIR", os.path.join(WORKDIR, "buffer_images"))
+# Снимок кэшей бенча с фейковыми фото не должен попасть в рабочий каталог бота
+os.environ.setdefault("SNAPSHOT_PATH", os.path.join(WORKDIR, "snapshot.json"))
+os.environ.setdefault("UNSPLASH_HOURLY_LIMIT", "1000000")
+os.environ.setdefault("UNSPLASH_ACCESS_KEY", "bench")
+os.environ.setdefault("METRICS_ENABLED", "0")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx  # noqa: E402
+from telegram import Update  # noqa: E402
+import bot  # noqa: E402
+import database  # noqa: E402
+from delivery_schedule import MINUTES_PER_DAY, current_epoch_minute  # noqa: E402
+import http_client  # noqa: E402
+from bench.fake_unsplash import FakeUnsplash  # noqa: E402
+from bench.fake_telegram import FakeTelegramRequest, BOT_USER  # noqa: E402
+
+SCENARIOS = ("random", "gallery", "settings", "download", "daily")
+QUERIES = ("mountain", "sea", "city night", "forest", "cat", "coffee", "desert", "snow")
+
+class UpdateFactory:
+    def __init__(self, telegram_bot):
+        self.bot = telegram_bot
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+
+    @staticmethod
+    def _user(user_id: int) -> dict:
+        return {"id": user_id, "is_bot": False, "first_name": f"user{user_id}"}
+
+    def _message(self, user_id: int, text: str, sender: dict) -> dict:
+        message = {
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": sender,
+            "text": text,
+        }
+        if text.startswith("/"):
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+        return message
+
+    def message(self, user_id: int, text: str) -> Update:
+        data = {"update_id": next(self._update_ids), "message": self._message(user_id, text, self._user(user_id))}
+        return Update.de_json(data, self.bot)
+
+    def callback(self, user_id: int, callback_data: str) -> Update:
+        data = {
+            "update_id": next(self._update_ids),
+            "callback_query": {
+                "id": str(next(self._update_ids)),
+                "from": self._user(user_id),
+                "chat_instance": str(user_id),
+                "data": callback_data,
+                "message": self._message(user_id, "menu", BOT_USER),
+            },
+        }
+        return Update.de_json(data, self.bot)
+
+def build_sessions(scenario: str, factory: UpdateFactory, users: list, repeat: int) -> list:
+    sessions = []
+    for n, user_id in enumerate(users):
+        if scenario == "random":
+            updates = [factory.callback(user_id, "random_photo") for _ in range(repeat)]
+        elif scenario == "gallery":
+            updates = [factory.message(user_id, "/gallery"), factory.message(user_id, QUERIES[n % len(QUERIES)])]
+            updates += [factory.callback(user_id, "gallery_next") for _ in range(repeat)]
+            updates += [factory.callback(user_id, "gallery_prev"), factory.callback(user_id, "gallery_select:3")]
+        elif scenario == "settings":
+            # Протокол s1; последняя кнопка — из старого протокола (сообщения, отправленные до обновления)
+            updates = [factory.callback(user_id, data) for data in (
+                "s1:m", "s1:o", "s1:o:2", "s1:c", "s1:c:11", "s1:b", "s1:b:1", "s1:r", "set_orientation:portrait",
+            )]
+        elif scenario == "download":
+            updates = [factory.callback(user_id, "random_photo"), factory.callback(user_id, "download_photo")]
+        else:
+            updates = []
+        sessions.append(updates)
+    return sessions
+
+async def drive(application, sessions: list, concurrency: int) -> list:
+    # Апдейты одного пользователя идут по порядку, разные пользователи — параллельно
+    latencies = []
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run_session(updates):
+        async with semaphore:
+            for update in updates:
+                started = time.perf_counter()
+                await application.process_update(update)
+                latencies.append(time.perf_counter() - started)
+
+    await asyncio.gather(*(run_session(updates) for updates in sessions))
+    return latencies
+
+def percentile(values: list, fraction: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))
+    return ordered[index]
+
+def peak_rss_mb() -> float:
+    # ru_maxrss в Linux — в килобайтах
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+async def run_daily(application, users: list) -> tuple:
+    # Все пользователи сценария попадают в корзину текущей минуты — тот же путь, что у delivery_tick:
+    # порции корзины из БД и общие на сутки пакеты фото по группам настроек
+    epoch_minute = current_epoch_minute()
+    for user_id in users:
+        await database.add_subscription(user_id, user_id)
+    await database.flush()
+    for user_id in users:
+        await database.set_delivery_schedule(user_id, epoch_minute % MINUTES_PER_DAY, "UTC")
+    started = time.perf_counter()
+    stats = await bot.run_delivery_bucket(application.bot, epoch_minute)
+    return time.perf_counter() - started, stats.sent + stats.failed + stats.blocked, stats.as_dict()
+
+async def main_async(args) -> list:
+    fake_unsplash = FakeUnsplash(latency=args.unsplash_latency, error_rate=args.unsplash_error_rate,
+                                 image_size=args.image_size)
+    fake_telegram = FakeTelegramRequest(latency=args.telegram_latency, error_429_rate=args.telegram_429_rate)
+    http_client.set_client(httpx.AsyncClient(transport=fake_unsplash.transport()))
+    database.DB_PATH = os.path.join(WORKDIR, "bench.db")
+    database.init_db()
+
+    application = bot.build_application(token="123456:BENCH", request=fake_telegram)
+    errors = Counter()
+
+    async def count_error(update, context):
+        errors[type(context.error).__name__] += 1
+
+    application.add_error_handler(count_error)
+    # Без Redis кэши и состояние работают на локальном запасном уровне — не шумим об этом
+    for name in ("search_cache", "user_state", "seen_filter"):
+        logging.getLogger(name).setLevel(logging.ERROR)
+    await application.initialize()
+    await bot.on_startup(application)
+    factory = UpdateFactory(application.bot)
+
+    report = []
+    user_ids = itertools.count(1_000_000)
+    try:
+        for scenario in args.scenarios:
+            users = [next(user_ids) for _ in range(args.users)]
+            unsplash_before = fake_unsplash.calls.copy()
+            telegram_before = fake_telegram.calls.copy()
+            errors.clear()
+            latencies = []
+            details = None
+            if scenario == "daily":
+                duration, processed, details = await run_daily(application, users)
+            else:
+                sessions = build_sessions(scenario, factory, users, args.repeat)
+                started = time.perf_counter()
+                latencies = await drive(application, sessions, args.concurrency)
+                duration = time.perf_counter() - started
+                processed = len(latencies)
+            report.append({
+                "scenario": scenario,
+                "updates": processed,
+                "duration_s": round(duration, 3),
+                "throughput_per_s": round(processed / duration, 1) if duration else 0.0,
+                "p50_ms": round(percentile(latencies, 0.50) * 1000, 1),
+                "p95_ms": round(percentile(latencies, 0.95) * 1000, 1),
+                "p99_ms": round(percentile(latencies, 0.99) * 1000, 1),
+                "unsplash_calls": dict(fake_unsplash.calls - unsplash_before),
+                "telegram_calls": dict(fake_telegram.calls - telegram_before),
+                "errors": dict(errors),
+                "details": details,
+                "peak_rss_mb": round(peak_rss_mb(), 1),
+            })
+    finally:
+        await bot.on_shutdown(application)
+        await application.shutdown()
+    return report
+
+def print_report(report: list):
+    header = f"{'сценарий':<10} {'апдейтов':>9} {'в сек':>8} {'p50 мс':>8} {'p95 мс':>8} {'p99 мс':>8} {'RSS МБ':>8}"
+    print(header)
+    print("-" * len(header))
+    for row in report:
+        print(f"{row['scenario']:<10} {row['updates']:>9} {row['throughput_per_s']:>8} {row['p50_ms']:>8} "
+              f"{row['p95_ms']:>8} {row['p99_ms']:>8} {row['peak_rss_mb']:>8}")
+    print()
+    for row in report:
+        print(f"{row['scenario']}: unsplash={row['unsplash_calls']} telegram={row['telegram_calls']} "
+              f"errors={row['errors']}" + (f" details={row['details']}" if row["details"] else ""))
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Нагрузочный прогон бота на имитациях Unsplash и Bot API")
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--repeat", type=int, default=3, help="повторов действия на пользователя")
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--unsplash-latency", type=float, default=0.08)
+    parser.add_argument("--unsplash-error-rate", type=float, default=0.0)
+    parser.add_argument("--telegram-latency", type=float, default=0.04)
+    parser.add_argument("--telegram-429-rate", type=float, default=0.0)
+    parser.add_argument("--image-size", type=int, default=4 * 1024 * 1024)
+    parser.add_argument("--json", help="сохранить отчёт в JSON-файл")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    report = asyncio.run(main_async(args))
+    print_report(report)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -1,148 +1,127 @@
 import datetime
 import logging
-import io
-from telegram import Update, InlineKeyboardMarkup, InlineKeyboardButton, InputMediaPhoto, InputFile
+import os
+import re
+import time
+from telegram import Update, InlineKeyboardMarkup, InlineKeyboardButton, InputFile
 from telegram.ext import (
     ApplicationBuilder,
     CommandHandler,
     CallbackQueryHandler,
+    InlineQueryHandler,
     MessageHandler,
-    ConversationHandler,
     ContextTypes,
     filters,
     JobQueue,  # <-- ОБРАТИТЕ ВНИМАНИЕ: импортируем JobQueue явно
 )
-from config import TELEGRAM_BOT_TOKEN
-from unsplash_client import get_random_photo, search_photos
+from telegram.request import HTTPXRequest
+from config import (
+    TELEGRAM_BOT_TOKEN,
+    BUFFER_JANITOR_INTERVAL,
+    METRICS_ENABLED,
+    METRICS_PORT,
+    BOT_MODE,
+    WEBHOOK_URL,
+    WEBHOOK_LISTEN,
+    WEBHOOK_PORT,
+    WEBHOOK_PATH,
+    WEBHOOK_SECRET,
+    UPDATE_CONCURRENCY,
+    RUN_SCHEDULED_JOBS,
+    GALLERY_MODE,
+    DAILY_CATCHUP_MINUTES,
+    DAILY_PAGE_SIZE,
+    DIAGNOSTICS_ENABLED,
+    ADMIN_IDS,
+)
+from search_cache import get_search_page, get_state_and_pages, prefetch_page
+from unsplash_scheduler import Priority, scheduler
 import database
 from utils.logger import setup_logger
-import httpx
+from http_client import init_client, close_client
+from downloads import open_download, DownloadTooLarge
+from photo_pool import RandomPhotoPools, settings_key, key_params, MAX_BATCH
+from unsplash_client import get_random_photos
+from models import Photo
+from notifier import run_delivery, DeliveryStats
+from delivery_schedule import (
+    MINUTES_PER_DAY,
+    bucket_run_id,
+    parse_bucket_run_id,
+    current_epoch_minute,
+    format_minute,
+    parse_time,
+    get_zone,
+)
+import file_cache
+import renditions
+import contact_sheet
+import inline_search
+import seen_filter
+import diagnostics
+import buffer_manager
+import snapshot
+import settings_menu
+from settings_menu import DEFAULT_SETTINGS
+import metrics
+import user_state
+import redis_client
+from update_processor import PerChatUpdateProcessor
 import asyncio
 
-# Если используете Redis и локальный буфер:
-# from redis_client import get_cached_search_results, cache_search_results, cache_gallery_state
-# from buffer_manager import get_buffered_image, cleanup_buffer
-
-# ------ Состояния ConversationHandler ------
-SEARCH = 1
-GALLERY_SEARCH = 2
-GALLERY_NAV = 3
-SETTINGS_MAIN, SET_ORIENTATION, SET_COLOR, SET_ORDER = range(10, 14)
-
 # ------ Глобальные переменные ------
-LAST_PHOTO = {}
-RANDOM_CACHE = []
-BUFFER_SIZE = 5
-
-DEFAULT_SETTINGS = {
-    "orientation": "any",
-    "color": "any",
-    "order_by": "relevant"
-}
+# Последнее показанное фото и состояние галереи хранятся в user_state (Redis)
+# Пулы предзагруженных фото по ключу (orientation, color)
+RANDOM_CACHE = RandomPhotoPools()
 
 setup_logger()
 logger = logging.getLogger(__name__)
 
-# ==================== ФУНКЦИИ НАСТРОЕК ====================
-def orientation_keyboard(current_settings: dict) -> InlineKeyboardMarkup:
-    options = ["any", "landscape", "portrait", "squarish"]
-    buttons = []
-    for option in options:
-        text = option
-        if current_settings.get("orientation", "any") == option:
-            text += " ✅"
-        buttons.append([InlineKeyboardButton(text, callback_data=f"set_orientation:{option}")])
-    buttons.append([InlineKeyboardButton("Назад", callback_data="settings_back")])
-    return InlineKeyboardMarkup(buttons)
-
-def color_keyboard(current_settings: dict) -> InlineKeyboardMarkup:
-    options = ["any", "black_and_white", "black", "white", "yellow", "orange", "red", "purple", "magenta", "green", "teal", "blue"]
-    buttons = []
-    for option in options:
-        text = option
-        if current_settings.get("color", "any") == option:
-            text += " ✅"
-        buttons.append([InlineKeyboardButton(text, callback_data=f"set_color:{option}")])
-    buttons.append([InlineKeyboardButton("Назад", callback_data="settings_back")])
-    return InlineKeyboardMarkup(buttons)
-
-def order_keyboard(current_settings: dict) -> InlineKeyboardMarkup:
-    options = ["relevant", "latest"]
-    buttons = []
-    for option in options:
-        text = option
-        if current_settings.get("order_by", "relevant") == option:
-            text += " ✅"
-        buttons.append([InlineKeyboardButton(text, callback_data=f"set_order:{option}")])
-    buttons.append([InlineKeyboardButton("Назад", callback_data="settings_back")])
-    return InlineKeyboardMarkup(buttons)
-
-def settings_menu_keyboard(current_settings: dict) -> InlineKeyboardMarkup:
-    text = (
-        f"Ваши настройки:\n"
-        f"Ориентация: {current_settings.get('orientation', 'any')}\n"
-        f"Цвет: {current_settings.get('color', 'any')}\n"
-        f"Сортировка: {current_settings.get('order_by', 'relevant')}"
-    )
-    keyboard = [
-        [InlineKeyboardButton("Изменить ориентацию", callback_data="settings_orientation")],
-        [InlineKeyboardButton("Изменить цвет", callback_data="settings_color")],
-        [InlineKeyboardButton("Изменить сортировку", callback_data="settings_order")],
-        [InlineKeyboardButton("Сбросить настройки", callback_data="reset_settings")],
-        [InlineKeyboardButton("Назад", callback_data="back_to_menu")]
-    ]
-    return InlineKeyboardMarkup(keyboard)
-
 # ==================== ОСНОВНОЕ МЕНЮ ====================
-def create_main_menu(is_subscribed: bool = False) -> InlineKeyboardMarkup:
+def _main_menu(is_subscribed: bool) -> InlineKeyboardMarkup:
     subscribe_text = "Отписаться" if is_subscribed else "Подписаться"
     keyboard = [
         [InlineKeyboardButton("Случайное фото", callback_data="random_photo")],
         [InlineKeyboardButton("Галерея", callback_data="gallery")],
-        [InlineKeyboardButton("Настройки", callback_data="settings_main")],
+        [InlineKeyboardButton("Настройки", callback_data=settings_menu.callback_data("m"))],
         [InlineKeyboardButton(subscribe_text, callback_data="toggle_subscription")],
     ]
     return InlineKeyboardMarkup(keyboard)
 
+# Два варианта главного меню строятся один раз
+MAIN_MENUS = {False: _main_menu(False), True: _main_menu(True)}
+
+def create_main_menu(is_subscribed: bool = False) -> InlineKeyboardMarkup:
+    return MAIN_MENUS[bool(is_subscribed)]
+
 # ==================== РАБОТА С СЛУЧАЙНЫМИ ФОТО ====================
-async def preload_random_photo(extra_params: dict):
-    photo = await get_random_photo(**extra_params)
-    if photo:
-        RANDOM_CACHE.append(photo)
+async def evict_random_pools(context: ContextTypes.DEFAULT_TYPE):
+    RANDOM_CACHE.evict_idle()
 
 async def random_photo_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
     user_id = query.from_user.id
     # Загружаем настройки пользователя
-    settings = database.get_user_settings(user_id) or DEFAULT_SETTINGS
-    extra_params = {}
-    if settings.get("orientation", "any") != "any":
-        extra_params["orientation"] = settings["orientation"]
-    if settings.get("color", "any") != "any":
-        extra_params["color"] = settings["color"]
-
-    # Берём фото из буфера или запрашиваем
-    if RANDOM_CACHE:
-        photo = RANDOM_CACHE.pop(0)
-    else:
-        photo = await get_random_photo(**extra_params)
+    settings = await database.get_user_settings(user_id) or DEFAULT_SETTINGS
 
-    # Предзагрузка следующего
-    if len(RANDOM_CACHE) < BUFFER_SIZE:
-        context.application.create_task(preload_random_photo(extra_params))
+    # Берём фото из пула под настройки пользователя, пропуская уже показанные ему;
+    # пул сам пополняется пачкой
+    seen = await seen_filter.load(user_id)
+    photo = await RANDOM_CACHE.get(settings, accept=lambda p: p.id not in seen)
 
     if photo:
-        LAST_PHOTO[user_id] = photo
-        image_url = photo.get("urls", {}).get("regular")
-        description = photo.get("description") or photo.get("alt_description") or "Без описания"
-        caption = f"{description}\nАвтор: {photo.get('user', {}).get('name', 'Неизвестно')}"
+        await user_state.set_last_photo(user_id, photo)
+        await seen_filter.mark(user_id, photo.id)
         keyboard = [
             [InlineKeyboardButton("Ещё", callback_data="random_photo")],
             [InlineKeyboardButton("Скачать", callback_data="download_photo")],
             [InlineKeyboardButton("Назад", callback_data="back_to_menu")]
         ]
-        await query.message.reply_photo(photo=image_url, caption=caption, reply_markup=InlineKeyboardMarkup(keyboard))
+        await file_cache.send_rendition(
+            query.message.reply_photo, photo, renditions.PREVIEW,
+            caption=photo.caption, reply_markup=InlineKeyboardMarkup(keyboard)
+        )
     else:
         await query.message.reply_text("Не удалось получить фото.")
 
@@ -150,23 +129,27 @@ async def download_photo_handler(update: Update, context: ContextTypes.DEFAULT_T
     query = update.callback_query
     await query.answer()
     user_id = query.from_user.id
-    photo = LAST_PHOTO.get(user_id)
+    photo = await user_state.get_last_photo(user_id)
     if not photo:
         await query.message.reply_text("Фото для скачивания не найдено.")
         return
-    full_url = photo.get("urls", {}).get("full")
+    # «Скачать» отдаёт оригинал, без пережатия
+    full_url = renditions.url(photo, renditions.ORIGINAL)
     if not full_url:
         await query.message.reply_text("Нет ссылки для скачивания.")
         return
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.get(full_url)
-        if response.status_code == 200:
-            file_bytes = io.BytesIO(response.content)
-            file_bytes.name = "photo.jpg"
-            await query.message.reply_document(document=InputFile(file_bytes))
-        else:
-            await query.message.reply_text("Не удалось скачать фото.")
+        async with open_download(full_url) as file_obj:
+            if file_obj is None:
+                await query.message.reply_text("Не удалось скачать фото.")
+                return
+            # read_file_handle=False: файл читается кусками при отправке, а не целиком в память
+            await query.message.reply_document(
+                document=InputFile(file_obj, filename="photo.jpg", read_file_handle=False)
+            )
+    except DownloadTooLarge as e:
+        logger.warning(f"Фото слишком большое для отправки: {e}")
+        await query.message.reply_text("Фото слишком большое для отправки.")
     except Exception as e:
         logger.error(f"Ошибка при скачивании фото: {e}")
         await query.message.reply_text("Ошибка при скачивании фото.")
@@ -177,72 +160,80 @@ async def toggle_subscription_handler(update: Update, context: ContextTypes.DEFA
     await query.answer()
     user = query.from_user
     chat_id = query.message.chat_id
-    if database.check_subscription(user.id):
-        database.remove_subscription(user.id)
+    if await database.check_subscription(user.id):
+        await database.remove_subscription(user.id)
         await query.message.reply_text("Вы отписались от уведомлений.")
     else:
-        database.add_subscription(user.id, chat_id)
+        await database.add_subscription(user.id, chat_id)
         await query.message.reply_text("Вы подписались на уведомления!")
-    is_subscribed = database.check_subscription(user.id)
+    is_subscribed = await database.check_subscription(user.id)
     await query.message.reply_text("Главное меню:", reply_markup=create_main_menu(is_subscribed))
 
 # ==================== ГАЛЕРЕЯ ====================
+# Состояние галереи живёт в user_state, а не в context.user_data и ConversationHandler:
+# следующий апдейт пользователя может обработать другой воркер
 async def gallery_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await user_state.update_state(update.effective_user.id, awaiting_query=True)
     await update.message.reply_text("Введите поисковый запрос для галереи:")
-    return GALLERY_SEARCH
+
+async def gallery_button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+    await user_state.update_state(query.from_user.id, awaiting_query=True)
+    await query.message.reply_text("Введите поисковый запрос для галереи:")
+
+async def cancel_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await user_state.update_state(update.effective_user.id, awaiting_query=False)
+    await update.message.reply_text("Операция отменена.", reply_markup=create_main_menu())
 
 async def gallery_search_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    # Пример без Redis (если используете Redis, добавьте логику из redis_client)
     query_text = update.message.text
     user_id = update.effective_user.id
-    settings = database.get_user_settings(user_id) or DEFAULT_SETTINGS
-    extra_params = {}
-    if settings.get("orientation", "any") != "any":
-        extra_params["orientation"] = settings["orientation"]
-    if settings.get("color", "any") != "any":
-        extra_params["color"] = settings["color"]
-    if settings.get("order_by", "relevant"):
-        extra_params["order_by"] = settings["order_by"]
-
+    settings = await database.get_user_settings(user_id) or DEFAULT_SETTINGS
     page = 1
-    results = await search_photos(query_text, page=page, per_page=10, **extra_params)
-    if results and results.get("results"):
-        context.user_data["gallery_query"] = query_text
-        context.user_data["gallery_page"] = page
-        context.user_data["gallery_total_pages"] = results.get("total_pages", 1)
-        context.user_data["gallery_results"] = results
-        await send_gallery(update.effective_chat.id, context)
+    # Состояние и закэшированная первая страница приходят из Redis одним запросом
+    state, preloaded = await get_state_and_pages(user_id, query_text, page, settings)
+    if not state.get("awaiting_query"):
+        return
+
+    results = await get_search_page(query_text, page, settings, preloaded=preloaded)
+    state["awaiting_query"] = False
+    if results and results.photos:
+        state["gallery_query"] = query_text
+        state["gallery_page"] = page
+        state["gallery_total_pages"] = results.total_pages
+        state["gallery_photos"] = [photo.to_dict() for photo in results.photos]
+        await user_state.save_state(user_id, state)
+        await send_gallery(update.effective_chat.id, state, settings, context)
+        if page < results.total_pages:
+            prefetch_page(query_text, page + 1, settings)
     else:
+        await user_state.save_state(user_id, state)
         await update.message.reply_text("Ничего не найдено.")
-        return ConversationHandler.END
-    return GALLERY_NAV
 
-async def send_gallery(chat_id, context: ContextTypes.DEFAULT_TYPE):
-    results = context.user_data.get("gallery_results")
-    if not results:
+async def send_gallery(chat_id, state: dict, settings: dict, context: ContextTypes.DEFAULT_TYPE):
+    photos = user_state.gallery_photos(state)
+    if not photos:
         return
-    media = []
-    for photo in results.get("results", []):
-        thumb_url = photo.get("urls", {}).get("small")
-        if thumb_url:
-            # Если используете локальный буфер:
-            # local_path = await get_buffered_image(thumb_url)
-            # if local_path:
-            #     media.append(InputMediaPhoto(media=local_path))
-            # else:
-            #     pass
-            # Без локального буфера:
-            media.append(InputMediaPhoto(media=thumb_url))
-    if media:
-        await context.bot.send_media_group(chat_id=chat_id, media=media)
+    if GALLERY_MODE == "sheet":
+        # Одна картинка-сетка на страницу вместо альбома из 10 фото
+        await contact_sheet.send_contact_sheet(
+            context.bot, chat_id, state["gallery_query"], settings, state.get("gallery_page", 1), photos
+        )
+    else:
+        items = [(photo.id, renditions.url(photo, renditions.THUMB)) for photo in photos]
+        items = [(photo_id, url) for photo_id, url in items if url]
+        if items:
+            # Уже отправленные миниатюры идут по file_id, новые — по URL
+            await file_cache.send_media_group(context.bot, chat_id, items, renditions.THUMB)
 
     # Формируем клавиатуру
     buttons = []
-    for i in range(len(results.get("results", []))):
+    for i in range(len(photos)):
         buttons.append(InlineKeyboardButton(f"{i+1}", callback_data=f"gallery_select:{i}"))
     nav_buttons = []
-    page = context.user_data.get("gallery_page", 1)
-    total = context.user_data.get("gallery_total_pages", 1)
+    page = state.get("gallery_page", 1)
+    total = state.get("gallery_total_pages", 1)
     if page > 1:
         nav_buttons.append(InlineKeyboardButton("◀ Предыдущая", callback_data="gallery_prev"))
     if page < total:
@@ -256,131 +247,326 @@ async def gallery_callback_handler(update: Update, context: ContextTypes.DEFAULT
     await query.answer()
     data = query.data
     user_id = query.from_user.id
+    state = await user_state.get_state(user_id)
     if data.startswith("gallery_select:"):
         index = int(data.split(":")[1])
-        results = context.user_data.get("gallery_results")
-        if results and index < len(results.get("results", [])):
-            photo = results["results"][index]
-            LAST_PHOTO[user_id] = photo
-            image_url = photo.get("urls", {}).get("full")
-            description = photo.get("description") or photo.get("alt_description") or "Без описания"
-            caption = f"{description}\nАвтор: {photo.get('user', {}).get('name', 'Неизвестно')}"
-            await query.message.reply_photo(photo=image_url, caption=caption)
+        photos = user_state.gallery_photos(state)
+        if index < len(photos):
+            photo = photos[index]
+            state["last_photo"] = photo.to_dict()
+            await user_state.save_state(user_id, state)
+            await file_cache.send_rendition(query.message.reply_photo, photo, renditions.PREVIEW, caption=photo.caption)
     elif data in ("gallery_next", "gallery_prev"):
-        current_page = context.user_data.get("gallery_page", 1)
-        total = context.user_data.get("gallery_total_pages", 1)
+        current_page = state.get("gallery_page", 1)
+        total = state.get("gallery_total_pages", 1)
         new_page = current_page + 1 if data == "gallery_next" else current_page - 1
         if new_page < 1 or new_page > total:
             return
-        query_text = context.user_data.get("gallery_query")
-        settings = database.get_user_settings(user_id) or DEFAULT_SETTINGS
-        extra_params = {}
-        if settings.get("orientation", "any") != "any":
-            extra_params["orientation"] = settings["orientation"]
-        if settings.get("color", "any") != "any":
-            extra_params["color"] = settings["color"]
-        if settings.get("order_by", "relevant"):
-            extra_params["order_by"] = settings["order_by"]
-
-        results = await search_photos(query_text, page=new_page, per_page=10, **extra_params)
-        if results and results.get("results"):
-            context.user_data["gallery_page"] = new_page
-            context.user_data["gallery_results"] = results
-            await send_gallery(query.message.chat_id, context)
-    elif data == "back_to_menu":
-        await query.message.reply_text("Главное меню:", reply_markup=create_main_menu(database.check_subscription(user_id)))
-    return GALLERY_NAV
+        query_text = state.get("gallery_query")
+        if not query_text:
+            return
+        settings = await database.get_user_settings(user_id) or DEFAULT_SETTINGS
+
+        results = await get_search_page(query_text, new_page, settings)
+        if results and results.photos:
+            state["gallery_page"] = new_page
+            state["gallery_photos"] = [photo.to_dict() for photo in results.photos]
+            await user_state.save_state(user_id, state)
+            await send_gallery(query.message.chat_id, state, settings, context)
+            if new_page < total:
+                prefetch_page(query_text, new_page + 1, settings)
+
+async def inline_query_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await inline_search.answer_inline_query(update.inline_query)
+
+async def back_to_menu_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+    user_id = query.from_user.id
+    await query.message.reply_text("Главное меню:", reply_markup=create_main_menu(await database.check_subscription(user_id)))
 
 # ==================== НАСТРОЙКИ ====================
 async def settings_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_id = update.effective_user.id
-    settings = database.get_user_settings(user_id)
-    if not settings:
-        settings = DEFAULT_SETTINGS.copy()
-        database.set_user_settings(user_id, settings)
-    await update.message.reply_text("Настройки поиска:", reply_markup=settings_menu_keyboard(settings))
+    await update.message.reply_text(settings_menu.MENU_TEXT, reply_markup=settings_menu.MENU_KEYBOARD)
 
 async def settings_callback_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
-    user_id = query.from_user.id
-    current_settings = database.get_user_settings(user_id) or DEFAULT_SETTINGS.copy()
-    data = query.data
-    if data == "settings_main":
-        await query.message.edit_text("Настройки поиска:", reply_markup=settings_menu_keyboard(current_settings))
-        return SETTINGS_MAIN
-    elif data == "settings_orientation":
-        await query.message.edit_text("Выберите ориентацию:", reply_markup=orientation_keyboard(current_settings))
-        return SET_ORIENTATION
-    elif data == "settings_color":
-        await query.message.edit_text("Выберите цвет:", reply_markup=color_keyboard(current_settings))
-        return SET_COLOR
-    elif data == "settings_order":
-        await query.message.edit_text("Выберите порядок сортировки:", reply_markup=order_keyboard(current_settings))
-        return SET_ORDER
-    elif data == "reset_settings":
-        database.set_user_settings(user_id, DEFAULT_SETTINGS.copy())
-        current_settings = DEFAULT_SETTINGS.copy()
-        await query.message.edit_text("Настройки сброшены.", reply_markup=settings_menu_keyboard(current_settings))
-        return SETTINGS_MAIN
-    elif data == "settings_back":
-        await query.message.edit_text("Настройки поиска:", reply_markup=settings_menu_keyboard(current_settings))
-        return SETTINGS_MAIN
-    elif data.startswith("set_orientation:"):
-        value = data.split(":")[1]
-        current_settings["orientation"] = value
-        database.set_user_settings(user_id, current_settings)
-        await query.message.edit_text("Настройки обновлены.", reply_markup=settings_menu_keyboard(current_settings))
-        return SETTINGS_MAIN
-    elif data.startswith("set_color:"):
-        value = data.split(":")[1]
-        current_settings["color"] = value
-        database.set_user_settings(user_id, current_settings)
-        await query.message.edit_text("Настройки обновлены.", reply_markup=settings_menu_keyboard(current_settings))
-        return SETTINGS_MAIN
-    elif data.startswith("set_order:"):
-        value = data.split(":")[1]
-        current_settings["order_by"] = value
-        database.set_user_settings(user_id, current_settings)
-        await query.message.edit_text("Настройки обновлены.", reply_markup=settings_menu_keyboard(current_settings))
-        return SETTINGS_MAIN
-
-def settings_fallback(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    return SETTINGS_MAIN
+    await settings_menu.handle(query)
 
 # ==================== ЕЖЕДНЕВНЫЕ УВЕДОМЛЕНИЯ ====================
-async def daily_notification(context: ContextTypes.DEFAULT_TYPE):
-    subscriptions = database.get_all_subscriptions()
-    for user_id, chat_id in subscriptions:
-        photo = await get_random_photo()
-        if photo:
-            image_url = photo.get("urls", {}).get("regular")
-            description = photo.get("description") or photo.get("alt_description") or "Без описания"
-            caption = f"{description}\nАвтор: {photo.get('user', {}).get('name', 'Неизвестно')}"
-            try:
-                await context.bot.send_photo(chat_id=chat_id, photo=image_url, caption=caption)
-            except Exception as e:
-                logger.error(f"Ошибка отправки уведомления пользователю {user_id}: {e}")
+# Пакеты фото для рассылки: (день UTC, группа настроек) -> Task со списком Photo.
+# Один запрос на группу в сутки, общий для всех минутных корзин этого дня
+_daily_batches = {}
+
+async def _fetch_daily_batch(key: tuple) -> list:
+    # Пакет всегда полный: запрос стоит столько же, а выбор для фильтра показанных шире
+    items = await get_random_photos(count=MAX_BATCH, priority=Priority.DAILY, **key_params(key))
+    return [Photo.from_api(item) for item in items or []]
+
+def _daily_batch(day: int, key: tuple):
+    task = _daily_batches.get((day, key))
+    if task is None:
+        for stale in [entry for entry in _daily_batches if entry[0] < day]:
+            del _daily_batches[stale]
+        task = asyncio.ensure_future(_fetch_daily_batch(key))
+        _daily_batches[(day, key)] = task
+
+        def forget_failed(done):
+            # Неудачный пакет не запоминаем: следующая корзина попробует снова
+            if done.cancelled() or done.exception() is not None or not done.result():
+                if _daily_batches.get((day, key)) is done:
+                    del _daily_batches[(day, key)]
+        task.add_done_callback(forget_failed)
+    return asyncio.shield(task)
+
+async def assign_daily_photos(subscriptions: list, day: int = None) -> dict:
+    """Подбирает фото подписчикам: один пакетный запрос на группу с одинаковыми (orientation, color) в сутки.
+
+    Фото группы раздаются участникам по кругу с пропуском уже показанных пользователю,
+    поэтому file_id одного фото переиспользуется. Возвращает user_id -> Photo;
+    подписчики группы, для которой пакет не получен, в ответ не попадают.
+    """
+    if day is None:
+        day = current_epoch_minute() // MINUTES_PER_DAY
+    groups = {}
+    for user_id, chat_id, settings in subscriptions:
+        groups.setdefault(settings_key(settings), []).append(user_id)
+
+    async def fetch(key: tuple):
+        try:
+            return await _daily_batch(day, key)
+        except Exception as e:
+            logger.error(f"Ошибка загрузки пакета фото для группы {key}: {e}")
+            return []
+
+    batches, seen = await asyncio.gather(
+        asyncio.gather(*(fetch(key) for key in groups)),
+        seen_filter.load_many([row[0] for row in subscriptions]),
+    )
+    assignment = {}
+    for (key, members), photos in zip(groups.items(), batches):
+        if not photos:
+            logger.warning(f"Не удалось получить фото для группы {key}, её подписчики получат фото из пула")
+            continue
+        for i, user_id in enumerate(members):
+            candidates = (photos[(i + shift) % len(photos)] for shift in range(len(photos)))
+            assignment[user_id] = next(
+                (photo for photo in candidates if photo.id not in seen[user_id]), photos[i % len(photos)]
+            )
+    await seen_filter.mark_many({user_id: [photo.id] for user_id, photo in assignment.items()})
+    logger.info(f"Фото для рассылки: {len(groups)} групп настроек, {len(assignment)} подписчиков")
+    return assignment
+
+async def send_daily_photo(bot, chat_id: int, photo: Photo = None, settings: dict = None):
+    if photo is None:
+        photo = await RANDOM_CACHE.get(settings or DEFAULT_SETTINGS, priority=Priority.DAILY)
+    if not photo:
+        raise RuntimeError("не удалось получить фото для уведомления")
+    await file_cache.send_rendition(
+        lambda **kwargs: bot.send_photo(chat_id=chat_id, **kwargs),
+        photo, renditions.DAILY, caption=photo.caption
+    )
+
+async def run_daily_notification(bot, run_id: str):
+    subscriptions = await database.get_subscriptions_with_settings()
+    # При возобновлении фото подбираем только тем, кто ещё не получил уведомление
+    delivered = await database.get_delivered_users(run_id)
+    subscriptions = [row for row in subscriptions if row[0] not in delivered]
+    settings_by_user = {user_id: settings for user_id, _, settings in subscriptions}
+    assignment = await assign_daily_photos(subscriptions)
+    return await run_delivery(
+        run_id,
+        [(user_id, chat_id) for user_id, chat_id, _ in subscriptions],
+        lambda user_id, chat_id: send_daily_photo(
+            bot, chat_id, assignment.get(user_id), settings_by_user.get(user_id)
+        ),
+        day=current_epoch_minute() // MINUTES_PER_DAY,
+    )
+
+async def _bucket_recipients(epoch_minute: int, delivered: set, assignment: dict, settings_by_user: dict):
+    # Корзина читается порциями по индексу; фото подбираются на порцию перед её отправкой
+    # из пакетов этого дня, общих для всех корзин
+    utc_minute, day = epoch_minute % MINUTES_PER_DAY, epoch_minute // MINUTES_PER_DAY
+    after_user_id = 0
+    while True:
+        # Получившие фото за эти сутки в другой корзине (сменили /time, сдвиг часового пояса) не попадут
+        rows = await database.get_bucket_subscribers(utc_minute, day, after_user_id, DAILY_PAGE_SIZE)
+        if not rows:
+            return
+        after_user_id = rows[-1][0]
+        pending = [row for row in rows if row[0] not in delivered]
+        if pending:
+            assignment.update(await assign_daily_photos(pending, day))
+        for user_id, chat_id, settings in rows:
+            if user_id not in delivered:
+                settings_by_user[user_id] = settings
+            yield user_id, chat_id
+
+async def run_delivery_bucket(bot, epoch_minute: int):
+    """Рассылка одной минутной корзины: подписчики, чьё время доставки в UTC приходится на эту минуту."""
+    run_id = bucket_run_id(epoch_minute)
+    day = epoch_minute // MINUTES_PER_DAY
+    # Пустые корзины (большинство минут суток) не оставляют записей в журнале рассылок
+    if not await database.get_bucket_subscribers(epoch_minute % MINUTES_PER_DAY, day, limit=1):
+        return DeliveryStats(run_id)
+    delivered = await database.get_delivered_users(run_id)
+    assignment, settings_by_user = {}, {}
+
+    async def deliver(user_id: int, chat_id: int):
+        await send_daily_photo(bot, chat_id, assignment.get(user_id), settings_by_user.get(user_id))
+        # Записи удаляются после отправки, чтобы память не росла с размером корзины
+        assignment.pop(user_id, None)
+        settings_by_user.pop(user_id, None)
+
+    return await run_delivery(
+        run_id,
+        _bucket_recipients(epoch_minute, delivered, assignment, settings_by_user),
+        deliver,
+        day=day,
+    )
+
+# Минута, до которой включительно корзины уже разосланы (в минутах эпохи UTC)
+LAST_MINUTE_KEY = "daily_last_minute"
+_tick_lock = asyncio.Lock()
+
+async def delivery_tick(context: ContextTypes.DEFAULT_TYPE):
+    """Раз в минуту рассылает текущую корзину и досылает пропущенные за время простоя."""
+    if _tick_lock.locked():
+        # Предыдущий тик ещё работает; пропущенные минуты он или следующий тик догонят сами
+        return
+    async with _tick_lock:
+        now_minute = current_epoch_minute()
+        stored = await database.get_scheduler_state(LAST_MINUTE_KEY)
+        last = int(stored) if stored is not None else now_minute - 1
+        start = max(last + 1, now_minute - DAILY_CATCHUP_MINUTES)
+        if start > last + 1:
+            logger.warning(f"Пропущено корзин рассылки: {start - last - 1}, старше {DAILY_CATCHUP_MINUTES} мин")
+        for minute in range(start, now_minute + 1):
+            stats = await run_delivery_bucket(context.bot, minute)
+            if stats.total:
+                logger.info(f"Корзина {format_minute(minute % MINUTES_PER_DAY)} UTC: {stats}")
+            await database.set_scheduler_state(LAST_MINUTE_KEY, str(minute))
+
+async def delivery_maintenance(context: ContextTypes.DEFAULT_TYPE):
+    # Раз в час: сдвиг корзин при переходе на летнее/зимнее время и чистка старых рассылок
+    moved = await database.refresh_utc_minutes()
+    if moved:
+        logger.info(f"Пересчитано время доставки после смены смещения часовых поясов: {moved}")
+    await database.cleanup_notification_runs()
+
+async def resume_notifications(context: ContextTypes.DEFAULT_TYPE):
+    # Досылаем рассылки, прерванные падением или перезапуском
+    oldest = current_epoch_minute() - DAILY_CATCHUP_MINUTES
+    stored = await database.get_scheduler_state(LAST_MINUTE_KEY)
+    last = int(stored) if stored is not None else None
+    for run_id, started_at in await database.get_unfinished_runs():
+        epoch_minute = parse_bucket_run_id(run_id)
+        if epoch_minute is None:
+            # Общая рассылка старого формата (daily:YYYY-MM-DD): тот же предел опоздания по началу
+            if started_at >= time.time() - DAILY_CATCHUP_MINUTES * 60:
+                logger.info(f"Возобновляем незавершённую рассылку {run_id}")
+                await run_daily_notification(context.bot, run_id)
+            else:
+                await database.finish_notification_run(run_id, {"abandoned": True})
+        elif last is not None and epoch_minute > last and epoch_minute >= oldest:
+            # Корзину ещё не отметили разосланной — её повторит delivery_tick
+            continue
+        elif epoch_minute >= oldest:
+            logger.info(f"Возобновляем незавершённую корзину {run_id}")
+            await run_delivery_bucket(context.bot, epoch_minute)
+        else:
+            # Слишком поздно присылать «ежедневное» фото — закрываем рассылку как брошенную
+            await database.finish_notification_run(run_id, {"abandoned": True})
+
+async def profile_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/profile [секунды] — запускает выборочный профилировщик, /profile stop — останавливает досрочно."""
+    if update.effective_user.id not in ADMIN_IDS:
+        return
+    chat_id = update.effective_chat.id
+    if context.args and context.args[0] == "stop":
+        for job in context.job_queue.get_jobs_by_name("profile"):
+            job.schedule_removal()
+        await send_profile(context.bot, chat_id)
+        return
+    seconds = int(context.args[0]) if context.args and context.args[0].isdigit() else 30
+    if not diagnostics.profiler.start(diagnostics.loop_thread_id):
+        await update.message.reply_text("Профилирование уже идёт. Остановить: /profile stop")
+        return
+    context.job_queue.run_once(finish_profile, seconds, chat_id=chat_id, name="profile")
+    await update.message.reply_text(f"Профилирование на {seconds} с запущено.")
+
+async def finish_profile(context: ContextTypes.DEFAULT_TYPE):
+    await send_profile(context.bot, context.job.chat_id)
+
+async def send_profile(bot, chat_id: int):
+    path = diagnostics.profiler.stop()
+    if path is None:
+        await bot.send_message(chat_id=chat_id, text="Профилирование не запущено.")
+        return
+    # Свёрнутые стеки: flamegraph.pl profile.folded > profile.svg или speedscope.app
+    with open(path, "rb") as f:
+        await bot.send_document(chat_id=chat_id, document=f, filename=os.path.basename(path))
+
+async def time_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user_id = update.effective_user.id
+    if not context.args:
+        current = await database.get_delivery_schedule(user_id)
+        if current is None:
+            await update.message.reply_text("Сначала подпишитесь: /subscribe")
+        else:
+            await update.message.reply_text(
+                f"Фото дня приходит в {format_minute(current[0])} ({current[1]}).\n"
+                "Изменить: /time ЧЧ:ММ, часовой пояс: /timezone Europe/Moscow"
+            )
+        return
+    minute = parse_time(context.args[0])
+    if minute is None:
+        await update.message.reply_text("Укажите время в формате ЧЧ:ММ, например /time 08:30")
+        return
+    if await database.set_delivery_schedule(user_id, delivery_minute=minute):
+        await update.message.reply_text(f"Готово, фото дня будет приходить в {format_minute(minute)}.")
+    else:
+        await update.message.reply_text("Сначала подпишитесь: /subscribe")
+
+async def timezone_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not context.args or get_zone(context.args[0]) is None:
+        await update.message.reply_text("Укажите часовой пояс в формате IANA, например /timezone Europe/Moscow")
+        return
+    tz = context.args[0]
+    if await database.set_delivery_schedule(update.effective_user.id, tz=tz):
+        await update.message.reply_text(f"Часовой пояс установлен: {tz}")
+    else:
+        await update.message.reply_text("Сначала подпишитесь: /subscribe")
 
 async def subscribe_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
     chat_id = update.effective_chat.id
-    if not database.check_subscription(user.id):
-        database.add_subscription(user.id, chat_id)
-        await update.message.reply_text("Вы подписались на уведомления!")
+    if not await database.check_subscription(user.id):
+        await database.add_subscription(user.id, chat_id)
+        schedule = await database.get_delivery_schedule(user.id)
+        if schedule:
+            await update.message.reply_text(
+                f"Вы подписались на уведомления! Фото дня будет приходить в {format_minute(schedule[0])} "
+                f"({schedule[1]}), изменить: /time ЧЧ:ММ"
+            )
+        else:
+            await update.message.reply_text("Вы подписались на уведомления!")
     else:
         await update.message.reply_text("Вы уже подписаны.")
-    is_subscribed = database.check_subscription(user.id)
+    is_subscribed = await database.check_subscription(user.id)
     await update.message.reply_text("Главное меню:", reply_markup=create_main_menu(is_subscribed))
 
 async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text(
-        "Команды:\n/start, /help, /subscribe, /unsubscribe, /settings, /gallery"
+        "Команды:\n/start, /help, /subscribe, /unsubscribe, /settings, /gallery\n"
+        "/time ЧЧ:ММ и /timezone — когда присылать фото дня\n"
+        f"Поиск в любом чате: @{context.bot.username} <запрос>"
     )
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
-    is_subscribed = database.check_subscription(user.id)
+    is_subscribed = await database.check_subscription(user.id)
     await update.message.reply_text(
         f"Привет, {user.first_name}!\nЭто бот для фото с Unsplash.\nВыберите опцию:",
         reply_markup=create_main_menu(is_subscribed)
@@ -388,29 +574,61 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def unsubscribe_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
-    if database.check_subscription(user.id):
-        database.remove_subscription(user.id)
+    if await database.check_subscription(user.id):
+        await database.remove_subscription(user.id)
         await update.message.reply_text("Вы отписались от уведомлений.")
     else:
         await update.message.reply_text("Вы не подписаны.")
-    is_subscribed = database.check_subscription(user.id)
+    is_subscribed = await database.check_subscription(user.id)
     await update.message.reply_text("Главное меню:", reply_markup=create_main_menu(is_subscribed))
 
-# ==================== ЗАПУСК БОТА (исправляем job_queue=None) ====================
-def main():
-    # Инициализируем БД
-    database.init_db()
+# ==================== ЖИЗНЕННЫЙ ЦИКЛ ПРИЛОЖЕНИЯ ====================
+async def on_startup(application):
+    # Общий HTTP-клиент создаётся вместе с Application и живёт до его остановки
+    await init_client()
+    diagnostics.start(DIAGNOSTICS_ENABLED)
+    buffer_manager.load_index()
+    database.start_invalidation_listener()
+    # Кэши и пулы из снимка прошлой остановки; пулы дозаполняются в фоне
+    snapshot.restore(RANDOM_CACHE)
+    if METRICS_ENABLED:
+        metrics.bind_scheduler(scheduler)
+        metrics.start_metrics_server(METRICS_PORT)
+
+async def on_shutdown(application):
+    await diagnostics.stop()
+    buffer_manager.save_index()
+    try:
+        snapshot.save(RANDOM_CACHE)
+    except Exception as e:
+        logger.error(f"Не удалось сохранить снимок: {e}")
+    await database.close()
+    await close_client()
+    try:
+        await redis_client.close()
+    except Exception as e:
+        logger.warning(f"Ошибка при закрытии Redis: {e}")
 
+# ==================== ЗАПУСК БОТА (исправляем job_queue=None) ====================
+def build_application(token: str = TELEGRAM_BOT_TOKEN, request=None):
+    # request позволяет подменить транспорт Bot API (используется в bench/)
     # 1) ЯВНО создаём JobQueue
     job_queue = JobQueue()
 
     # 2) Создаём Application, передаём в него наш job_queue
-    application = (
+    # Все вызовы Bot API проходят через обёртку с метриками
+    builder = (
         ApplicationBuilder()
-        .token(TELEGRAM_BOT_TOKEN)
+        .token(token)
         .job_queue(job_queue)
-        .build()
+        .request(metrics.InstrumentedRequest(request or HTTPXRequest(connection_pool_size=256)))
+        .concurrent_updates(PerChatUpdateProcessor(UPDATE_CONCURRENCY))
+        .post_init(on_startup)
+        .post_shutdown(on_shutdown)
     )
+    if request is not None:
+        builder = builder.get_updates_request(request)
+    application = builder.build()
 
     # 3) Привязываем очередь к приложению
     job_queue.set_application(application)
@@ -422,56 +640,78 @@ def main():
     application.add_handler(CommandHandler("unsubscribe", unsubscribe_command))
     application.add_handler(CommandHandler("settings", settings_command))
     application.add_handler(CommandHandler("gallery", gallery_command))
-
-    # Conversation для галереи
-    gallery_conv = ConversationHandler(
-        entry_points=[CommandHandler("gallery", gallery_command)],
-        states={
-            GALLERY_SEARCH: [MessageHandler(filters.TEXT & ~filters.COMMAND, gallery_search_handler)],
-            GALLERY_NAV: [
-                CallbackQueryHandler(gallery_callback_handler, pattern="^(gallery_select:.*|gallery_next|gallery_prev|back_to_menu)$")
-            ]
-        },
-        fallbacks=[CommandHandler("cancel", lambda u, c: u.message.reply_text("Операция отменена.", reply_markup=create_main_menu()))],
-        # per_message=False по умолчанию – предупреждение можно игнорировать, если бот работает
-    )
-    application.add_handler(gallery_conv)
-
-    # Conversation для настроек
-    settings_conv = ConversationHandler(
-        entry_points=[CallbackQueryHandler(settings_callback_handler, pattern="^(settings_.*|set_.*|reset_settings)$")],
-        states={
-            SET_ORIENTATION: [
-                CallbackQueryHandler(settings_callback_handler, pattern="^(set_orientation:.*|settings_back)$")
-            ],
-            SET_COLOR: [
-                CallbackQueryHandler(settings_callback_handler, pattern="^(set_color:.*|settings_back)$")
-            ],
-            SET_ORDER: [
-                CallbackQueryHandler(settings_callback_handler, pattern="^(set_order:.*|settings_back)$")
-            ],
-            SETTINGS_MAIN: [
-                CallbackQueryHandler(settings_callback_handler, pattern="^(settings_.*|reset_settings)$")
-            ],
-        },
-        fallbacks=[CommandHandler("cancel", lambda u, c: u.message.reply_text("Операция отменена.", reply_markup=create_main_menu()))],
-    )
-    application.add_handler(settings_conv)
+    application.add_handler(CommandHandler("cancel", cancel_command))
+    application.add_handler(CommandHandler("time", time_command))
+    application.add_handler(CommandHandler("timezone", timezone_command))
+    application.add_handler(CommandHandler("profile", profile_command))
+
+    # Галерея и настройки без ConversationHandler: состояние хранится в Redis,
+    # поэтому любой воркер может обработать любой апдейт
+    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, gallery_search_handler))
+    application.add_handler(CallbackQueryHandler(gallery_button_handler, pattern="^gallery$"))
+    application.add_handler(CallbackQueryHandler(gallery_callback_handler, pattern="^(gallery_select:.*|gallery_next|gallery_prev)$"))
+    # Настройки: разбор по таблице settings_menu.ACTIONS, старые callback_data тоже принимаются
+    application.add_handler(CallbackQueryHandler(settings_callback_handler, pattern=settings_menu.is_settings_callback))
 
     # Inline-обработчики
     application.add_handler(CallbackQueryHandler(random_photo_handler, pattern="^random_photo$"))
     application.add_handler(CallbackQueryHandler(download_photo_handler, pattern="^download_photo$"))
     application.add_handler(CallbackQueryHandler(toggle_subscription_handler, pattern="^toggle_subscription$"))
-    application.add_handler(CallbackQueryHandler(lambda u, c: u.answer(), pattern="^back_to_menu$"))
+    application.add_handler(CallbackQueryHandler(back_to_menu_handler, pattern="^back_to_menu$"))
+
+    # Поиск через @бот <запрос> (inline-режим включается у @BotFather командой /setinline)
+    application.add_handler(InlineQueryHandler(inline_query_handler))
+
+    # Чистим пулы случайных фото, которыми давно не пользовались
+    job_queue.run_repeating(evict_random_pools, interval=600, first=600)
+
+    # Уборка дискового буфера изображений
+    job_queue.run_repeating(buffer_manager.cleanup_buffer, interval=BUFFER_JANITOR_INTERVAL, first=BUFFER_JANITOR_INTERVAL)
+
+    # 4) Ежедневные уведомления (только на одном из воркеров): каждую минуту — своя корзина
+    # подписчиков, поэтому отправка размазана по суткам, а не идёт одним всплеском
+    if RUN_SCHEDULED_JOBS:
+        now = datetime.datetime.now(datetime.timezone.utc)
+        next_minute = now.replace(second=0, microsecond=0) + datetime.timedelta(minutes=1)
+        job_queue.run_repeating(
+            delivery_tick, interval=60, first=next_minute,
+            job_kwargs={"max_instances": 1, "coalesce": True, "misfire_grace_time": None},
+        )
+        job_queue.run_repeating(delivery_maintenance, interval=3600, first=5)
+        job_queue.run_once(resume_notifications, when=10)
+
+    # Замер времени для всех обработчиков, зарегистрированных выше
+    metrics.instrument_handlers(application)
+    return application
+
+def check_webhook_config():
+    # Без секрета любой, кто достучится до порта, сможет прислать поддельный апдейт
+    # (в том числе от имени администратора из ADMIN_IDS)
+    if not WEBHOOK_URL:
+        raise SystemExit("BOT_MODE=webhook: не задан WEBHOOK_URL (публичный https-адрес бота)")
+    if not WEBHOOK_SECRET:
+        raise SystemExit("BOT_MODE=webhook: не задан WEBHOOK_SECRET, без него webhook принимает чужие запросы")
+    if not re.fullmatch(r"[A-Za-z0-9_-]{1,256}", WEBHOOK_SECRET):
+        raise SystemExit("WEBHOOK_SECRET: допустимы 1-256 символов A-Z, a-z, 0-9, _ и -")
 
-    # 4) Планируем ежедневные уведомления
-    job_queue.run_daily(
-        daily_notification,
-        time=datetime.time(hour=10, minute=0, second=0)
-    )
+def main():
+    if BOT_MODE == "webhook":
+        check_webhook_config()
+    # Инициализируем БД
+    database.init_db()
+    application = build_application()
 
     # 5) Запуск бота
-    application.run_polling()
+    if BOT_MODE == "webhook":
+        application.run_webhook(
+            listen=WEBHOOK_LISTEN,
+            port=WEBHOOK_PORT,
+            url_path=WEBHOOK_PATH,
+            webhook_url=f"{WEBHOOK_URL.rstrip('/')}/{WEBHOOK_PATH}",
+            secret_token=WEBHOOK_SECRET,
+        )
+    else:
+        application.run_polling()
 
 if __name__ == '__main__':
     main()
@@ -1,46 +1,190 @@
 import os
+import re
 import time
+import json
+import heapq
+import hashlib
+import logging
 import uuid
-import httpx
 import aiofiles
 import asyncio
+from collections import OrderedDict
+from http_client import get_client
+import metrics
+from config import BUFFER_DIR, BUFFER_MAX_BYTES, BUFFER_TTL
 
-BUFFER_DIR = "buffer_images"
+logger = logging.getLogger(__name__)
+
+INDEX_PATH = os.path.join(BUFFER_DIR, "index.json")
 
 if not os.path.exists(BUFFER_DIR):
     os.makedirs(BUFFER_DIR)
 
-# Простой in‑memory кэш: URL -> {path, time}
-CACHE = {}
-CACHE_TTL = 3600  # время жизни в секундах
-
-async def download_image(url: str) -> str:
-    filename = f"{uuid.uuid4()}.jpg"
-    filepath = os.path.join(BUFFER_DIR, filename)
-    async with httpx.AsyncClient() as client:
-        response = await client.get(url)
-    if response.status_code == 200:
-        async with aiofiles.open(filepath, "wb") as f:
-            await f.write(response.content)
-        CACHE[url] = {"path": filepath, "time": time.time()}
-        return filepath
-    return None
-
-async def get_buffered_image(url: str) -> str:
-    entry = CACHE.get(url)
-    if entry and (time.time() - entry["time"]) < CACHE_TTL and os.path.exists(entry["path"]):
-        return entry["path"]
-    return await download_image(url)
-
-async def cleanup_buffer():
+# Индекс кэша: ключ -> {url, path, size, time, expires}; порядок = LRU (последние в конце)
+CACHE = OrderedDict()
+CACHE_TTL = BUFFER_TTL  # время жизни в секундах
+# Куча (expires, key) для истечения по TTL без полного обхода индекса
+_expiry_heap = []
+_total_bytes = 0
+# Скачивания в процессе: ключ -> Task, чтобы один URL качался один раз
+_inflight = {}
+# Раскладка кэша: <2 hex>/<64 hex>.jpg и недокачанные <...>.jpg.<32 hex>.tmp.
+# Удаляем только такие имена: BUFFER_DIR задаётся из окружения и может указывать не туда
+_SHARD_RE = re.compile(r"[0-9a-f]{2}")
+_FILE_RE = re.compile(r"[0-9a-f]{64}\.jpg(\.[0-9a-f]{32}\.tmp)?")
+
+def cache_key(source: str) -> str:
+    return hashlib.sha256(source.encode("utf-8")).hexdigest()
+
+def _path_for(key: str) -> str:
+    return os.path.join(BUFFER_DIR, key[:2], f"{key}.jpg")
+
+def _add_entry(key: str, entry: dict):
+    global _total_bytes
+    _drop_entry(key, remove_file=False)
+    CACHE[key] = entry
+    _total_bytes += entry["size"]
+    heapq.heappush(_expiry_heap, (entry["expires"], key))
+
+def _remove_files(paths: list):
+    for path in paths:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logger.warning(f"Не удалось удалить {path}: {e}")
+
+def _drop_entry(key: str, remove_file: bool = True, removed: list = None):
+    # removed: путь копится для удаления вне цикла событий вместо немедленного os.remove
+    global _total_bytes
+    entry = CACHE.pop(key, None)
+    if entry is None:
+        return
+    _total_bytes -= entry["size"]
+    if removed is not None:
+        removed.append(entry["path"])
+    elif remove_file:
+        _remove_files([entry["path"]])
+
+def _expire(now: float, removed: list = None):
+    while _expiry_heap and _expiry_heap[0][0] <= now:
+        expires, key = heapq.heappop(_expiry_heap)
+        entry = CACHE.get(key)
+        # Запись могла быть перезаписана с новым сроком — тогда в куче устаревший элемент
+        if entry is not None and entry["expires"] == expires:
+            _drop_entry(key, removed=removed)
+    # Куча растёт от перезаписей; пересобираем, когда мусора становится много
+    if len(_expiry_heap) > 2 * len(CACHE) + 64:
+        _expiry_heap[:] = [(entry["expires"], key) for key, entry in CACHE.items()]
+        heapq.heapify(_expiry_heap)
+
+def _evict_to_budget(removed: list = None):
+    while _total_bytes > BUFFER_MAX_BYTES and CACHE:
+        key = next(iter(CACHE))
+        _drop_entry(key, removed=removed)
+
+def _lookup(key: str):
+    entry = CACHE.get(key)
+    if entry is None:
+        return None
+    if entry["expires"] <= time.time():
+        _drop_entry(key)
+        return None
+    CACHE.move_to_end(key)
+    return entry["path"]
+
+async def download_image(url: str, key: str = None) -> str:
+    key = key or cache_key(url)
+    filepath = _path_for(key)
+    os.makedirs(os.path.dirname(filepath), exist_ok=True)
+    # Пишем во временный файл и атомарно переименовываем: недокачанный файл не попадёт в кэш
+    tmp_path = f"{filepath}.{uuid.uuid4().hex}.tmp"
+    size = 0
+    try:
+        async with get_client().stream("GET", url) as response:
+            if response.status_code != 200:
+                return None
+            async with aiofiles.open(tmp_path, "wb") as f:
+                async for chunk in response.aiter_bytes():
+                    size += len(chunk)
+                    await f.write(chunk)
+        os.replace(tmp_path, filepath)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    now = time.time()
+    _add_entry(key, {"url": url, "path": filepath, "size": size, "time": now, "expires": now + CACHE_TTL})
+    _evict_to_budget()
+    return filepath
+
+async def get_buffered_image(url: str, key: str = None) -> str:
+    """Возвращает путь к локальной копии url; key (например, id фото) заменяет url в качестве ключа."""
+    key = cache_key(key or url)
+    path = _lookup(key)
+    if path and os.path.exists(path):
+        metrics.cache_hit("image_buffer")
+        return path
+    metrics.cache_miss("image_buffer")
+    task = _inflight.get(key)
+    if task is None:
+        task = asyncio.ensure_future(download_image(url, key))
+        _inflight[key] = task
+        task.add_done_callback(lambda _: _inflight.pop(key, None))
+    try:
+        return await asyncio.shield(task)
+    except Exception as e:
+        logger.error(f"Ошибка загрузки изображения в буфер: {e}")
+        return None
+
+def load_index():
+    """Восстанавливает индекс после перезапуска и удаляет файлы, которых в нём нет."""
+    CACHE.clear()
+    _expiry_heap.clear()
+    global _total_bytes
+    _total_bytes = 0
+    entries = []
+    try:
+        with open(INDEX_PATH, "r", encoding="utf-8") as f:
+            entries = json.load(f)
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        logger.warning(f"Индекс буфера повреждён, начинаем с пустого: {e}")
     now = time.time()
-    to_delete = []
-    for url, entry in CACHE.items():
-        if now - entry["time"] > CACHE_TTL:
-            to_delete.append(url)
-            try:
-                os.remove(entry["path"])
-            except Exception:
-                pass
-    for url in to_delete:
-        del CACHE[url]
+    for key, entry in entries:
+        if entry["expires"] > now and os.path.exists(entry["path"]):
+            _add_entry(key, entry)
+    known = {entry["path"] for entry in CACHE.values()}
+    for shard in os.listdir(BUFFER_DIR):
+        shard_dir = os.path.join(BUFFER_DIR, shard)
+        if not _SHARD_RE.fullmatch(shard) or not os.path.isdir(shard_dir):
+            continue
+        for name in os.listdir(shard_dir):
+            path = os.path.join(shard_dir, name)
+            if _FILE_RE.fullmatch(name) and path not in known:
+                try:
+                    os.remove(path)
+                except Exception:
+                    pass
+    _evict_to_budget()
+    logger.info(f"Буфер изображений: {len(CACHE)} файлов, {_total_bytes} байт")
+
+def _write_index(entries: list):
+    tmp_path = f"{INDEX_PATH}.{uuid.uuid4().hex}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(entries, f)
+    os.replace(tmp_path, INDEX_PATH)
+
+def save_index():
+    _write_index(list(CACHE.items()))
+
+async def cleanup_buffer(context=None):
+    # Фоновая уборка: истёкшие по TTL, затем сверх бюджета по LRU, затем сохранение индекса.
+    # Индекс меняется в цикле событий, а удаление файлов и запись JSON уходят в поток
+    removed = []
+    _expire(time.time(), removed)
+    _evict_to_budget(removed)
+    entries = list(CACHE.items())
+    await asyncio.to_thread(_remove_files, removed)
+    await asyncio.to_thread(_write_index, entries)
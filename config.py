@@ -6,3 +6,158 @@ load_dotenv()
 TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
 UNSPLASH_ACCESS_KEY = os.getenv("UNSPLASH_ACCESS_KEY")
 UNSPLASH_SECRET_KEY = os.getenv("UNSPLASH_SECRET_KEY")
+
+# ------ HTTP-клиент (общий пул соединений) ------
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "100"))
+HTTP_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("HTTP_MAX_KEEPALIVE_CONNECTIONS", "20"))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "30"))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "5"))
+HTTP_READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", "15"))
+HTTP_POOL_TIMEOUT = float(os.getenv("HTTP_POOL_TIMEOUT", "5"))
+HTTP2_ENABLED = os.getenv("HTTP2_ENABLED", "1") == "1"
+
+# ------ Пулы предзагрузки случайных фото ------
+RANDOM_POOL_SIZE = int(os.getenv("RANDOM_POOL_SIZE", "30"))
+RANDOM_POOL_LOW_WATERMARK = int(os.getenv("RANDOM_POOL_LOW_WATERMARK", "10"))
+RANDOM_POOL_IDLE_TTL = float(os.getenv("RANDOM_POOL_IDLE_TTL", "1800"))
+# Сколько последних выданных фото держать, чтобы было что показать, когда пул пуст и Unsplash недоступен
+RANDOM_POOL_STALE_SIZE = int(os.getenv("RANDOM_POOL_STALE_SIZE", "20"))
+
+# ------ Рассылка ежедневных уведомлений ------
+NOTIFY_CONCURRENCY = int(os.getenv("NOTIFY_CONCURRENCY", "20"))
+# Telegram допускает ~30 сообщений/с на бота; держим запас
+NOTIFY_RATE = float(os.getenv("NOTIFY_RATE", "25"))
+NOTIFY_CHAT_INTERVAL = float(os.getenv("NOTIFY_CHAT_INTERVAL", "1"))
+NOTIFY_GROUP_INTERVAL = float(os.getenv("NOTIFY_GROUP_INTERVAL", "3"))
+NOTIFY_MAX_RETRIES = int(os.getenv("NOTIFY_MAX_RETRIES", "3"))
+# Время доставки по умолчанию (местное) и окно, по которому новые подписчики равномерно раскидываются
+DAILY_DEFAULT_TIME = os.getenv("DAILY_DEFAULT_TIME", "10:00")
+DAILY_DEFAULT_TZ = os.getenv("DAILY_DEFAULT_TZ", "UTC")
+DAILY_SPREAD_MINUTES = int(os.getenv("DAILY_SPREAD_MINUTES", "120"))
+# Сколько пропущенных минут досылать после простоя; более старые корзины пропускаются
+DAILY_CATCHUP_MINUTES = int(os.getenv("DAILY_CATCHUP_MINUTES", "180"))
+# Подписчиков минутной корзины читаем из БД порциями
+DAILY_PAGE_SIZE = int(os.getenv("DAILY_PAGE_SIZE", "500"))
+
+# ------ Кэш Telegram file_id ------
+FILE_ID_CACHE_SIZE = int(os.getenv("FILE_ID_CACHE_SIZE", "50000"))
+
+# ------ Скачивание оригиналов ------
+DOWNLOAD_CONCURRENCY = int(os.getenv("DOWNLOAD_CONCURRENCY", "4"))
+DOWNLOAD_SPOOL_THRESHOLD = int(os.getenv("DOWNLOAD_SPOOL_THRESHOLD", str(256 * 1024)))
+# Bot API не принимает документы больше 50 МБ
+DOWNLOAD_MAX_BYTES = int(os.getenv("DOWNLOAD_MAX_BYTES", str(50 * 1024 * 1024)))
+DOWNLOAD_CHUNK_SIZE = int(os.getenv("DOWNLOAD_CHUNK_SIZE", str(64 * 1024)))
+
+# ------ Локальный буфер изображений ------
+BUFFER_DIR = os.getenv("BUFFER_DIR", "buffer_images")
+BUFFER_MAX_BYTES = int(os.getenv("BUFFER_MAX_BYTES", str(512 * 1024 * 1024)))
+BUFFER_TTL = float(os.getenv("BUFFER_TTL", "86400"))
+BUFFER_JANITOR_INTERVAL = float(os.getenv("BUFFER_JANITOR_INTERVAL", "300"))
+
+# ------ Квота Unsplash ------
+# 50 запросов/час для demo-приложений, 5000 — для production; уточняется по X-Ratelimit-Limit
+UNSPLASH_HOURLY_LIMIT = int(os.getenv("UNSPLASH_HOURLY_LIMIT", "50"))
+UNSPLASH_MAX_CONCURRENCY = int(os.getenv("UNSPLASH_MAX_CONCURRENCY", "10"))
+UNSPLASH_LOW_PRIORITY_MAX_WAIT = float(os.getenv("UNSPLASH_LOW_PRIORITY_MAX_WAIT", "3600"))
+
+# ------ Устойчивость к сбоям Unsplash ------
+# Таймауты на весь запрос по эндпоинтам, в секундах
+UNSPLASH_RANDOM_TIMEOUT = float(os.getenv("UNSPLASH_RANDOM_TIMEOUT", "4"))
+UNSPLASH_SEARCH_TIMEOUT = float(os.getenv("UNSPLASH_SEARCH_TIMEOUT", "5"))
+# Цепь размыкается после N ошибок подряд и через RESET секунд пропускает пробный запрос
+UNSPLASH_BREAKER_FAILURES = int(os.getenv("UNSPLASH_BREAKER_FAILURES", "5"))
+UNSPLASH_BREAKER_RESET = float(os.getenv("UNSPLASH_BREAKER_RESET", "30"))
+# Через сколько секунд без ответа интерактивный запрос дублируется; 0 — не дублировать
+UNSPLASH_HEDGE_DELAY = float(os.getenv("UNSPLASH_HEDGE_DELAY", "1.0"))
+
+# ------ Кэш страниц поиска галереи ------
+SEARCH_CACHE_LOCAL_SIZE = int(os.getenv("SEARCH_CACHE_LOCAL_SIZE", "2000"))
+# Страница старше FRESH_TTL отдаётся сразу и обновляется в фоне; LOCAL/REDIS_TTL — предельный срок хранения
+SEARCH_CACHE_FRESH_TTL = float(os.getenv("SEARCH_CACHE_FRESH_TTL", "600"))
+SEARCH_CACHE_LOCAL_TTL = float(os.getenv("SEARCH_CACHE_LOCAL_TTL", "3600"))
+SEARCH_CACHE_REDIS_TTL = int(os.getenv("SEARCH_CACHE_REDIS_TTL", "86400"))
+
+# ------ База данных ------
+# Несколько воркеров должны видеть один файл: в docker-compose он лежит на общем томе ./data
+DB_PATH = os.getenv("DB_PATH", "subscriptions.db")
+DB_CACHE_SIZE = int(os.getenv("DB_CACHE_SIZE", "100000"))
+DB_WRITE_FLUSH_INTERVAL = float(os.getenv("DB_WRITE_FLUSH_INTERVAL", "0.05"))
+# Запасной срок жизни кэша настроек и подписок на случай потерянного сообщения о сбросе
+DB_CACHE_TTL = float(os.getenv("DB_CACHE_TTL", "300"))
+
+# ------ Метрики ------
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") == "1"
+METRICS_PORT = int(os.getenv("METRICS_PORT", "8000"))
+
+# ------ Режим работы и масштабирование ------
+# polling — один процесс; webhook — можно запускать несколько воркеров за балансировщиком.
+# Воркеры делят Redis и файл SQLite (DB_PATH), поэтому должны работать на одном хосте
+# с общим томом: SQLite на сетевой ФС и воркеры на разных машинах не поддерживаются
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080"))
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "telegram")
+# Обязателен в режиме webhook: Telegram присылает его в заголовке, чужие запросы отклоняются
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET") or None
+UPDATE_CONCURRENCY = int(os.getenv("UPDATE_CONCURRENCY", "256"))
+# Плановые задачи (рассылка, уборка) должны работать только на одном воркере
+RUN_SCHEDULED_JOBS = os.getenv("RUN_SCHEDULED_JOBS", "1") == "1"
+# Порядок апдейтов одного чата между воркерами: короткая блокировка в Redis на время обработки
+CHAT_LOCK_ENABLED = os.getenv("CHAT_LOCK_ENABLED", "1" if BOT_MODE == "webhook" else "0") == "1"
+CHAT_LOCK_TTL = float(os.getenv("CHAT_LOCK_TTL", "30"))
+CHAT_LOCK_WAIT = float(os.getenv("CHAT_LOCK_WAIT", "10"))
+# Сброс кэшей настроек и подписок на остальных воркерах через Redis pub/sub
+DB_CACHE_INVALIDATION = os.getenv("DB_CACHE_INVALIDATION", "1" if BOT_MODE == "webhook" else "0") == "1"
+USER_STATE_TTL = int(os.getenv("USER_STATE_TTL", "86400"))
+USER_STATE_LOCAL_SIZE = int(os.getenv("USER_STATE_LOCAL_SIZE", "10000"))
+
+# ------ Режим галереи ------
+# album — альбом из 10 миниатюр; sheet — одна картинка-сетка с номерами на страницу
+GALLERY_MODE = os.getenv("GALLERY_MODE", "album")
+CONTACT_SHEET_COLUMNS = int(os.getenv("CONTACT_SHEET_COLUMNS", "5"))
+CONTACT_SHEET_CELL_WIDTH = int(os.getenv("CONTACT_SHEET_CELL_WIDTH", "320"))
+CONTACT_SHEET_CELL_HEIGHT = int(os.getenv("CONTACT_SHEET_CELL_HEIGHT", "240"))
+
+# ------ Redis ------
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+REDIS_MAX_CONNECTIONS = int(os.getenv("REDIS_MAX_CONNECTIONS", "50"))
+REDIS_SOCKET_TIMEOUT = float(os.getenv("REDIS_SOCKET_TIMEOUT", "2"))
+# Значения больше порога сжимаются zlib
+REDIS_COMPRESS_THRESHOLD = int(os.getenv("REDIS_COMPRESS_THRESHOLD", "1024"))
+
+# ------ Inline-режим ------
+# cache_time ответа Telegram: полные страницы кэшируются надолго, ответы по префиксу — ненадолго
+INLINE_CACHE_TIME = int(os.getenv("INLINE_CACHE_TIME", "300"))
+INLINE_PREFIX_CACHE_TIME = int(os.getenv("INLINE_PREFIX_CACHE_TIME", "5"))
+# Пауза, после которой запрос считается дописанным; более новый запрос того же пользователя отменяет старый
+INLINE_DEBOUNCE = float(os.getenv("INLINE_DEBOUNCE", "0.4"))
+INLINE_MIN_QUERY_LENGTH = int(os.getenv("INLINE_MIN_QUERY_LENGTH", "3"))
+INLINE_RESULTS_CACHE_SIZE = int(os.getenv("INLINE_RESULTS_CACHE_SIZE", "5000"))
+
+# ------ Фильтр уже показанных фото ------
+# Фильтр Блума на пользователя: BITS бит (8192 = 1 КБ) и HASHES хэш-функций; ~2% ложных срабатываний
+# на 1000 фото. Поколения сменяются раз в ROTATE_DAYS дней, проверяются текущее и предыдущее
+SEEN_FILTER_BITS = int(os.getenv("SEEN_FILTER_BITS", "8192"))
+SEEN_FILTER_HASHES = int(os.getenv("SEEN_FILTER_HASHES", "4"))
+SEEN_FILTER_ROTATE_DAYS = int(os.getenv("SEEN_FILTER_ROTATE_DAYS", "30"))
+
+# ------ Диагностика ------
+# Замер задержки цикла событий, сторож зависаний и трассировка апдейтов (небольшие накладные расходы)
+DIAGNOSTICS_ENABLED = os.getenv("DIAGNOSTICS_ENABLED", "0") == "1"
+LOOP_LAG_INTERVAL = float(os.getenv("LOOP_LAG_INTERVAL", "0.25"))
+# Если цикл не отвечает дольше порога, сторож пишет в лог стек потока цикла
+LOOP_STALL_THRESHOLD = float(os.getenv("LOOP_STALL_THRESHOLD", "0.5"))
+# Апдейты дольше порога пишутся в лог с разбивкой по вызовам Unsplash, Telegram и БД
+TRACE_SLOW_UPDATE = float(os.getenv("TRACE_SLOW_UPDATE", "1.0"))
+PROFILE_INTERVAL = float(os.getenv("PROFILE_INTERVAL", "0.005"))
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+# Telegram id администраторов через запятую (команда /profile)
+ADMIN_IDS = {int(value) for value in os.getenv("ADMIN_IDS", "").split(",") if value.strip()}
+
+# ------ Снимок кэшей при перезапуске ------
+# Пишется при штатной остановке и читается при старте, чтобы не начинать с пустых кэшей
+SNAPSHOT_PATH = os.getenv("SNAPSHOT_PATH", "snapshot.json")
+# Пулы случайных фото старше этого возраста не восстанавливаются
+SNAPSHOT_POOL_TTL = float(os.getenv("SNAPSHOT_POOL_TTL", "21600"))
@@ -0,0 +1,98 @@
+import asyncio
+import hashlib
+import io
+import logging
+from PIL import Image, ImageDraw, ImageFont
+from telegram.error import BadRequest
+import buffer_manager
+import file_cache
+import renditions
+from search_cache import normalize_query, search_params
+from config import CONTACT_SHEET_COLUMNS, CONTACT_SHEET_CELL_WIDTH, CONTACT_SHEET_CELL_HEIGHT
+
+logger = logging.getLogger(__name__)
+
+SHEET_RENDITION = "sheet"
+PADDING = 6
+BACKGROUND = (24, 24, 24)
+PLACEHOLDER = (64, 64, 64)
+
+# Рендеры в процессе: ключ листа -> Task, чтобы одну страницу не рисовать дважды
+_inflight = {}
+
+def sheet_key(query: str, settings: dict, page: int, photos: list) -> str:
+    # Страница со временем меняется (фоновое обновление, order_by=latest), поэтому в ключе
+    # и сами фото по порядку: иначе номера на старом листе разойдутся с кнопками
+    params = "&".join(f"{k}={v}" for k, v in sorted(search_params(settings).items()))
+    ids = ",".join(photo.id for photo in photos)
+    raw = f"{normalize_query(query)}|{params}|{page}|{ids}"
+    return "sheet:" + hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+def _fit(image: Image.Image, width: int, height: int) -> Image.Image:
+    # Обрезка по центру до пропорций ячейки, затем уменьшение
+    ratio = max(width / image.width, height / image.height)
+    resized = image.resize((max(1, round(image.width * ratio)), max(1, round(image.height * ratio))))
+    left = (resized.width - width) // 2
+    top = (resized.height - height) // 2
+    return resized.crop((left, top, left + width, top + height))
+
+def render_contact_sheet(paths: list) -> bytes:
+    """Рисует сетку миниатюр с номерами 1..N (совпадают с кнопками gallery_select:{i})."""
+    columns = min(CONTACT_SHEET_COLUMNS, max(1, len(paths)))
+    rows = (len(paths) + columns - 1) // columns
+    cell_w, cell_h = CONTACT_SHEET_CELL_WIDTH, CONTACT_SHEET_CELL_HEIGHT
+    sheet = Image.new(
+        "RGB",
+        (columns * cell_w + (columns + 1) * PADDING, rows * cell_h + (rows + 1) * PADDING),
+        BACKGROUND,
+    )
+    draw = ImageDraw.Draw(sheet)
+    font = ImageFont.load_default(size=cell_h // 5)
+    for i, path in enumerate(paths):
+        x = PADDING + (i % columns) * (cell_w + PADDING)
+        y = PADDING + (i // columns) * (cell_h + PADDING)
+        try:
+            with Image.open(path) as thumb:
+                sheet.paste(_fit(thumb.convert("RGB"), cell_w, cell_h), (x, y))
+        except Exception:
+            draw.rectangle((x, y, x + cell_w, y + cell_h), fill=PLACEHOLDER)
+        label = str(i + 1)
+        box = draw.textbbox((0, 0), label, font=font)
+        badge_w, badge_h = box[2] - box[0] + 2 * PADDING, box[3] - box[1] + 2 * PADDING
+        draw.rectangle((x, y, x + badge_w, y + badge_h), fill=(0, 0, 0))
+        draw.text((x + PADDING - box[0], y + PADDING - box[1]), label, fill=(255, 255, 255), font=font)
+    output = io.BytesIO()
+    sheet.save(output, format="JPEG", quality=85, optimize=True)
+    return output.getvalue()
+
+async def _build(photos: list) -> bytes:
+    # Миниатюры качаются параллельно и берутся из дискового буфера, если уже есть
+    paths = await asyncio.gather(*(
+        buffer_manager.get_buffered_image(renditions.url(photo, renditions.THUMB), key=f"{photo.id}:{renditions.THUMB}")
+        for photo in photos
+    ))
+    return await asyncio.to_thread(render_contact_sheet, list(paths))
+
+async def _render_once(key: str, photos: list) -> bytes:
+    task = _inflight.get(key)
+    if task is None:
+        task = asyncio.ensure_future(_build(photos))
+        _inflight[key] = task
+        task.add_done_callback(lambda _: _inflight.pop(key, None))
+    return await asyncio.shield(task)
+
+async def send_contact_sheet(bot, chat_id: int, query: str, settings: dict, page: int, photos: list):
+    key = sheet_key(query, settings, page, photos)
+    caption = f"«{query}», страница {page}"
+    file_id = await file_cache.get_file_id(key, SHEET_RENDITION)
+    if file_id:
+        try:
+            return await bot.send_photo(chat_id=chat_id, photo=file_id, caption=caption)
+        except BadRequest as e:
+            logger.warning(f"file_id листа {key} не принят: {e}")
+            await file_cache.forget(key, SHEET_RENDITION)
+    data = await _render_once(key, photos)
+    message = await bot.send_photo(chat_id=chat_id, photo=data, caption=caption)
+    if message is not None and message.photo:
+        await file_cache.remember(key, SHEET_RENDITION, message.photo[-1].file_id)
+    return message
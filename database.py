@@ -1,70 +1,415 @@
 import sqlite3
 import json
+import time
+import asyncio
+import logging
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from utils.lru import LRUCache
+import delivery_schedule
+import redis_client
+import tracing
+from config import DB_PATH, DB_CACHE_SIZE, DB_CACHE_TTL, DB_WRITE_FLUSH_INTERVAL, DB_CACHE_INVALIDATION
 
-DB_PATH = "subscriptions.db"
+logger = logging.getLogger(__name__)
+
+# Все обращения к SQLite идут через один поток с одним долгоживущим соединением:
+# цикл событий никогда не ждёт диск, а sqlite3 переиспользует подготовленные выражения
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite")
+_conn = None
+
+# Кэш чтения: user_id -> настройки / признак подписки. Другие воркеры пишут в тот же файл,
+# поэтому после их записи запись кэша сбрасывается сообщением через Redis (см. ниже)
+_settings_cache = LRUCache(DB_CACHE_SIZE, ttl=DB_CACHE_TTL)
+_subscription_cache = LRUCache(DB_CACHE_SIZE, ttl=DB_CACHE_TTL)
+# Отложенные записи, сливаются в одну транзакцию; последняя запись по ключу побеждает
+_pending_settings = {}
+_pending_subscriptions = {}  # user_id -> chat_id или None (удаление)
+_flush_task = None
+# Отличает свои сообщения о сбросе кэша от чужих
+_WORKER_ID = uuid.uuid4().hex
+_listener_task = None
+
+def _get_conn() -> sqlite3.Connection:
+    global _conn
+    if _conn is None:
+        _conn = sqlite3.connect(DB_PATH, check_same_thread=False, cached_statements=256)
+        _conn.execute("PRAGMA journal_mode=WAL")
+        _conn.execute("PRAGMA synchronous=NORMAL")
+        _conn.execute("PRAGMA busy_timeout=5000")
+    return _conn
+
+async def _run(fn, *args):
+    with tracing.span("db", fn.__name__.lstrip("_")):
+        return await asyncio.get_running_loop().run_in_executor(_executor, fn, *args)
+
+def _fetchone(sql: str, params: tuple = ()):
+    return _get_conn().execute(sql, params).fetchone()
+
+def _fetchall(sql: str, params: tuple = ()):
+    return _get_conn().execute(sql, params).fetchall()
+
+def _execute(sql: str, params: tuple = ()):
+    conn = _get_conn()
+    with conn:
+        conn.execute(sql, params)
+
+def _executemany(sql: str, rows: list):
+    conn = _get_conn()
+    with conn:
+        conn.executemany(sql, rows)
+
+def _init_schema():
+    conn = _get_conn()
+    with conn:
+        conn.execute('''
+        CREATE TABLE IF NOT EXISTS subscriptions (
+            user_id INTEGER PRIMARY KEY,
+            chat_id INTEGER NOT NULL
+        )
+        ''')
+        conn.execute('''
+        CREATE TABLE IF NOT EXISTS user_settings (
+            user_id INTEGER PRIMARY KEY,
+            settings TEXT
+        )
+        ''')
+        conn.execute('''
+        CREATE TABLE IF NOT EXISTS telegram_files (
+            photo_id TEXT NOT NULL,
+            rendition TEXT NOT NULL,
+            file_id TEXT NOT NULL,
+            PRIMARY KEY (photo_id, rendition)
+        )
+        ''')
+        conn.execute('''
+        CREATE TABLE IF NOT EXISTS notification_runs (
+            run_id TEXT PRIMARY KEY,
+            started_at REAL NOT NULL,
+            finished_at REAL,
+            stats TEXT
+        )
+        ''')
+        conn.execute('''
+        CREATE TABLE IF NOT EXISTS notification_deliveries (
+            run_id TEXT NOT NULL,
+            user_id INTEGER NOT NULL,
+            PRIMARY KEY (run_id, user_id)
+        )
+        ''')
+        conn.execute('''
+        CREATE TABLE IF NOT EXISTS scheduler_state (
+            name TEXT PRIMARY KEY,
+            value TEXT
+        )
+        ''')
+        _migrate_delivery_schedule(conn)
+        _migrate_last_daily_day(conn)
+
+def _migrate_delivery_schedule(conn: sqlite3.Connection):
+    # Время доставки: местная минута суток, часовой пояс и вычисленная по ним минута UTC (номер корзины)
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(subscriptions)")}
+    for name, column_type in (("delivery_minute", "INTEGER"), ("tz", "TEXT"), ("utc_minute", "INTEGER")):
+        if name not in columns:
+            conn.execute(f"ALTER TABLE subscriptions ADD COLUMN {name} {column_type}")
+    missing = [row[0] for row in conn.execute("SELECT user_id FROM subscriptions WHERE delivery_minute IS NULL")]
+    if missing:
+        conn.executemany(
+            "UPDATE subscriptions SET delivery_minute = ?, tz = ?, utc_minute = ? WHERE user_id = ?",
+            [(*delivery_schedule.default_schedule(user_id), user_id) for user_id in missing]
+        )
+        logger.info(f"Назначено время доставки существующим подписчикам: {len(missing)}")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_subscriptions_bucket ON subscriptions (utc_minute, user_id)")
+
+def _migrate_last_daily_day(conn: sqlite3.Connection):
+    # День UTC (номер суток эпохи) последней ежедневной доставки: смена /time или сдвиг корзины
+    # при переходе на летнее время не должны принести второе фото за сутки
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(subscriptions)")}
+    if "last_daily_day" not in columns:
+        conn.execute("ALTER TABLE subscriptions ADD COLUMN last_daily_day INTEGER")
 
 def init_db():
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS subscriptions (
-        user_id INTEGER PRIMARY KEY,
-        chat_id INTEGER NOT NULL
+    # Вызывается до запуска цикла событий, поэтому ждём синхронно
+    _executor.submit(_init_schema).result()
+
+# ------ Пакетная запись ------
+def _write_batch(settings: dict, subscriptions: dict):
+    conn = _get_conn()
+    with conn:
+        if settings:
+            conn.executemany(
+                "INSERT OR REPLACE INTO user_settings (user_id, settings) VALUES (?, ?)",
+                [(user_id, json.dumps(value)) for user_id, value in settings.items()]
+            )
+        added = [(user_id, chat_id) for user_id, chat_id in subscriptions.items() if chat_id is not None]
+        removed = [(user_id,) for user_id, chat_id in subscriptions.items() if chat_id is None]
+        if added:
+            # Повторная подписка меняет только chat_id, выбранное время доставки сохраняется
+            conn.executemany(
+                "INSERT INTO subscriptions (user_id, chat_id, delivery_minute, tz, utc_minute) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT(user_id) DO UPDATE SET chat_id = excluded.chat_id",
+                [(user_id, chat_id, *delivery_schedule.default_schedule(user_id)) for user_id, chat_id in added]
+            )
+        if removed:
+            conn.executemany("DELETE FROM subscriptions WHERE user_id = ?", removed)
+
+async def flush():
+    global _pending_settings, _pending_subscriptions
+    if not _pending_settings and not _pending_subscriptions:
+        return
+    settings, subscriptions = _pending_settings, _pending_subscriptions
+    _pending_settings, _pending_subscriptions = {}, {}
+    try:
+        await _run(_write_batch, settings, subscriptions)
+    except Exception as e:
+        logger.error(f"Ошибка записи в БД, повторим позже: {e}")
+        # Возвращаем несохранённое, не затирая более свежие записи
+        _pending_settings = {**settings, **_pending_settings}
+        _pending_subscriptions = {**subscriptions, **_pending_subscriptions}
+        _schedule_flush()
+        return
+    # Сообщаем после коммита: получив его, другой воркер прочитает уже новые строки
+    await _publish_invalidation(list(settings), list(subscriptions))
+
+async def _delayed_flush():
+    await asyncio.sleep(DB_WRITE_FLUSH_INTERVAL)
+    await flush()
+
+def _schedule_flush():
+    global _flush_task
+    if _flush_task is None or _flush_task.done():
+        _flush_task = asyncio.create_task(_delayed_flush())
+
+# ------ Сброс кэшей между воркерами ------
+async def _publish_invalidation(settings_ids: list, subscription_ids: list):
+    if not DB_CACHE_INVALIDATION:
+        return
+    message = {"worker": _WORKER_ID, "settings": settings_ids, "subscriptions": subscription_ids}
+    try:
+        await redis_client.publish_invalidation(message)
+    except Exception as e:
+        logger.warning(f"Не удалось разослать сброс кэша БД: {e}")
+
+async def _listen_invalidations():
+    while True:
+        try:
+            async for message in redis_client.invalidation_messages():
+                if message.get("worker") == _WORKER_ID:
+                    continue
+                for user_id in message.get("settings", ()):
+                    _settings_cache.pop(user_id)
+                for user_id in message.get("subscriptions", ()):
+                    _subscription_cache.pop(user_id)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning(f"Канал сброса кэша БД недоступен: {e}")
+        # Пока канала не было, сообщения могли потеряться — кэшу больше верить нельзя
+        _settings_cache.clear()
+        _subscription_cache.clear()
+        await asyncio.sleep(5)
+
+def start_invalidation_listener():
+    global _listener_task
+    if DB_CACHE_INVALIDATION and _listener_task is None:
+        _listener_task = asyncio.create_task(_listen_invalidations())
+
+async def close():
+    global _conn, _listener_task
+    if _listener_task is not None:
+        _listener_task.cancel()
+        await asyncio.gather(_listener_task, return_exceptions=True)
+        _listener_task = None
+    await flush()
+    if _conn is not None:
+        await _run(_conn.close)
+        _conn = None
+
+# ------ Подписки ------
+async def add_subscription(user_id: int, chat_id: int):
+    _subscription_cache.set(user_id, True)
+    _pending_subscriptions[user_id] = chat_id
+    _schedule_flush()
+
+async def remove_subscription(user_id: int):
+    _subscription_cache.set(user_id, False)
+    _pending_subscriptions[user_id] = None
+    _schedule_flush()
+
+async def check_subscription(user_id: int) -> bool:
+    if user_id in _pending_subscriptions:
+        return _pending_subscriptions[user_id] is not None
+    cached = _subscription_cache.get(user_id)
+    if cached is not None:
+        return cached
+    result = await _run(_fetchone, "SELECT 1 FROM subscriptions WHERE user_id = ?", (user_id,))
+    _subscription_cache.set(user_id, bool(result))
+    return bool(result)
+
+async def get_all_subscriptions():
+    await flush()
+    return await _run(_fetchall, "SELECT user_id, chat_id FROM subscriptions")
+
+async def get_subscriptions_with_settings() -> list:
+    """Подписчики вместе с сохранёнными настройками одним запросом: [(user_id, chat_id, settings)]."""
+    await flush()
+    rows = await _run(
+        _fetchall,
+        "SELECT s.user_id, s.chat_id, us.settings FROM subscriptions s "
+        "LEFT JOIN user_settings us ON us.user_id = s.user_id"
+    )
+    return [(user_id, chat_id, json.loads(settings) if settings else {}) for user_id, chat_id, settings in rows]
+
+# ------ Время доставки ------
+async def get_delivery_schedule(user_id: int):
+    # (delivery_minute, tz) подписчика или None, если он не подписан
+    await flush()
+    return await _run(_fetchone, "SELECT delivery_minute, tz FROM subscriptions WHERE user_id = ?", (user_id,))
+
+async def set_delivery_schedule(user_id: int, delivery_minute: int = None, tz: str = None) -> bool:
+    """Меняет время и/или часовой пояс подписчика и переносит его в новую корзину; False — не подписан."""
+    current = await get_delivery_schedule(user_id)
+    if current is None:
+        return False
+    delivery_minute = current[0] if delivery_minute is None else delivery_minute
+    tz = tz or current[1]
+    await _run(
+        _execute,
+        "UPDATE subscriptions SET delivery_minute = ?, tz = ?, utc_minute = ? WHERE user_id = ?",
+        (delivery_minute, tz, delivery_schedule.utc_minute(delivery_minute, tz), user_id)
     )
-    ''')
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS user_settings (
-        user_id INTEGER PRIMARY KEY,
-        settings TEXT
+    return True
+
+def _refresh_utc_minutes() -> int:
+    conn = _get_conn()
+    updated = 0
+    with conn:
+        for (tz,) in conn.execute("SELECT DISTINCT tz FROM subscriptions").fetchall():
+            offset = delivery_schedule.utc_offset_minutes(tz)
+            # Обновляются только строки, чья корзина действительно сдвинулась
+            updated += conn.execute(
+                "UPDATE subscriptions SET utc_minute = (delivery_minute - ? + 2880) % 1440 "
+                "WHERE tz = ? AND utc_minute != (delivery_minute - ? + 2880) % 1440",
+                (offset, tz, offset)
+            ).rowcount
+    return updated
+
+async def refresh_utc_minutes() -> int:
+    # Пересчёт корзин после перехода часовых поясов на летнее/зимнее время
+    return await _run(_refresh_utc_minutes)
+
+async def get_bucket_subscribers(utc_minute: int, day: int, after_user_id: int = 0, limit: int = 500) -> list:
+    """Порция подписчиков минутной корзины после after_user_id (keyset по индексу (utc_minute, user_id)).
+
+    Подписчики, уже получившие фото в сутки day или позже, пропускаются.
+    """
+    rows = await _run(
+        _fetchall,
+        "SELECT s.user_id, s.chat_id, us.settings FROM subscriptions s "
+        "LEFT JOIN user_settings us ON us.user_id = s.user_id "
+        "WHERE s.utc_minute = ? AND s.user_id > ? AND (s.last_daily_day IS NULL OR s.last_daily_day < ?) "
+        "ORDER BY s.user_id LIMIT ?",
+        (utc_minute, after_user_id, day, limit)
     )
-    ''')
-    conn.commit()
-    conn.close()
-
-def add_subscription(user_id: int, chat_id: int):
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute("INSERT OR REPLACE INTO subscriptions (user_id, chat_id) VALUES (?, ?)", (user_id, chat_id))
-    conn.commit()
-    conn.close()
-
-def remove_subscription(user_id: int):
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute("DELETE FROM subscriptions WHERE user_id = ?", (user_id,))
-    conn.commit()
-    conn.close()
-
-def check_subscription(user_id: int) -> bool:
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute("SELECT 1 FROM subscriptions WHERE user_id = ?", (user_id,))
-    result = cursor.fetchone()
-    conn.close()
-    return bool(result)
+    return [(user_id, chat_id, json.loads(settings) if settings else {}) for user_id, chat_id, settings in rows]
+
+async def get_scheduler_state(name: str):
+    row = await _run(_fetchone, "SELECT value FROM scheduler_state WHERE name = ?", (name,))
+    return row[0] if row else None
+
+async def set_scheduler_state(name: str, value: str):
+    await _run(_execute, "INSERT OR REPLACE INTO scheduler_state (name, value) VALUES (?, ?)", (name, value))
+
+# ------ Настройки ------
+async def get_user_settings(user_id: int) -> dict:
+    if user_id in _pending_settings:
+        return dict(_pending_settings[user_id])
+    cached = _settings_cache.get(user_id)
+    if cached is None:
+        row = await _run(_fetchone, "SELECT settings FROM user_settings WHERE user_id = ?", (user_id,))
+        cached = json.loads(row[0]) if row else {}
+        _settings_cache.set(user_id, cached)
+    # Отдаём копию: обработчики меняют словарь перед сохранением
+    return dict(cached)
+
+async def set_user_settings(user_id: int, settings: dict):
+    settings = dict(settings)
+    _settings_cache.set(user_id, settings)
+    _pending_settings[user_id] = settings
+    _schedule_flush()
+
+# ------ Кэш Telegram file_id ------
+async def get_file_id(photo_id: str, rendition: str):
+    row = await _run(
+        _fetchone,
+        "SELECT file_id FROM telegram_files WHERE photo_id = ? AND rendition = ?",
+        (photo_id, rendition)
+    )
+    return row[0] if row else None
+
+async def set_file_id(photo_id: str, rendition: str, file_id: str):
+    await _run(
+        _execute,
+        "INSERT OR REPLACE INTO telegram_files (photo_id, rendition, file_id) VALUES (?, ?, ?)",
+        (photo_id, rendition, file_id)
+    )
+
+async def delete_file_id(photo_id: str, rendition: str):
+    await _run(_execute, "DELETE FROM telegram_files WHERE photo_id = ? AND rendition = ?", (photo_id, rendition))
+
+# ------ Прогресс рассылки уведомлений ------
+async def start_notification_run(run_id: str):
+    await _run(
+        _execute,
+        "INSERT OR IGNORE INTO notification_runs (run_id, started_at) VALUES (?, ?)",
+        (run_id, time.time())
+    )
+
+async def finish_notification_run(run_id: str, stats: dict):
+    await _run(
+        _execute,
+        "UPDATE notification_runs SET finished_at = ?, stats = ? WHERE run_id = ?",
+        (time.time(), json.dumps(stats), run_id)
+    )
+
+async def get_unfinished_runs() -> list:
+    # [(run_id, started_at)] от старых к новым
+    return await _run(
+        _fetchall, "SELECT run_id, started_at FROM notification_runs WHERE finished_at IS NULL ORDER BY started_at"
+    )
+
+async def get_delivered_users(run_id: str) -> set:
+    rows = await _run(_fetchall, "SELECT user_id FROM notification_deliveries WHERE run_id = ?", (run_id,))
+    return {row[0] for row in rows}
+
+def _mark_delivered(run_id: str, user_ids: list, day: int = None):
+    conn = _get_conn()
+    with conn:
+        conn.executemany(
+            "INSERT OR IGNORE INTO notification_deliveries (run_id, user_id) VALUES (?, ?)",
+            [(run_id, user_id) for user_id in user_ids]
+        )
+        if day is not None:
+            # В той же транзакции, что и журнал: отметка дня не разойдётся с фактом доставки
+            conn.executemany(
+                "UPDATE subscriptions SET last_daily_day = ? WHERE user_id = ? "
+                "AND (last_daily_day IS NULL OR last_daily_day < ?)",
+                [(day, user_id, day) for user_id in user_ids]
+            )
+
+async def mark_delivered(run_id: str, user_ids: list, day: int = None):
+    """Отмечает доставку в журнале рассылки; day — сутки UTC ежедневного фото для подписчика."""
+    await _run(_mark_delivered, run_id, user_ids, day)
+
+def _cleanup_runs(cutoff: float):
+    conn = _get_conn()
+    with conn:
+        conn.execute(
+            "DELETE FROM notification_deliveries WHERE run_id IN "
+            "(SELECT run_id FROM notification_runs WHERE finished_at IS NOT NULL AND finished_at < ?)",
+            (cutoff,)
+        )
+        conn.execute("DELETE FROM notification_runs WHERE finished_at IS NOT NULL AND finished_at < ?", (cutoff,))
 
-def get_all_subscriptions():
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute("SELECT user_id, chat_id FROM subscriptions")
-    results = cursor.fetchall()
-    conn.close()
-    return results
-
-def get_user_settings(user_id: int) -> dict:
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute("SELECT settings FROM user_settings WHERE user_id = ?", (user_id,))
-    row = cursor.fetchone()
-    conn.close()
-    if row:
-        return json.loads(row[0])
-    return {}
-
-def set_user_settings(user_id: int, settings: dict):
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    settings_json = json.dumps(settings)
-    cursor.execute("INSERT OR REPLACE INTO user_settings (user_id, settings) VALUES (?, ?)", (user_id, settings_json))
-    conn.commit()
-    conn.close()
+async def cleanup_notification_runs(keep_seconds: float = 7 * 86400):
+    await _run(_cleanup_runs, time.time() - keep_seconds)
@@ -0,0 +1,57 @@
+import datetime
+import zlib
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+from config import DAILY_DEFAULT_TIME, DAILY_DEFAULT_TZ, DAILY_SPREAD_MINUTES
+
+MINUTES_PER_DAY = 1440
+RUN_ID_FORMAT = "%Y-%m-%d:%H:%M"
+
+def parse_time(text: str):
+    # «ЧЧ:ММ» -> минута суток; None, если формат неверный
+    try:
+        value = datetime.datetime.strptime(text.strip(), "%H:%M")
+    except ValueError:
+        return None
+    return value.hour * 60 + value.minute
+
+def format_minute(minute: int) -> str:
+    return f"{minute // 60:02d}:{minute % 60:02d}"
+
+def get_zone(name: str):
+    try:
+        return ZoneInfo(name)
+    except (ZoneInfoNotFoundError, ValueError):
+        return None
+
+def utc_offset_minutes(tz: str, now: datetime.datetime = None) -> int:
+    zone = get_zone(tz) or datetime.timezone.utc
+    now = now or datetime.datetime.now(datetime.timezone.utc)
+    return int(now.astimezone(zone).utcoffset().total_seconds() // 60)
+
+def utc_minute(delivery_minute: int, tz: str) -> int:
+    # Смещение берётся текущее: после перехода на летнее/зимнее время корзины пересчитываются
+    return (delivery_minute - utc_offset_minutes(tz)) % MINUTES_PER_DAY
+
+def default_schedule(user_id: int) -> tuple:
+    """(delivery_minute, tz, utc_minute) нового подписчика: детерминированный сдвиг внутри окна рассылки."""
+    base = parse_time(DAILY_DEFAULT_TIME) or 0
+    jitter = zlib.crc32(str(user_id).encode()) % max(DAILY_SPREAD_MINUTES, 1)
+    minute = (base + jitter) % MINUTES_PER_DAY
+    return minute, DAILY_DEFAULT_TZ, utc_minute(minute, DAILY_DEFAULT_TZ)
+
+def current_epoch_minute() -> int:
+    return int(datetime.datetime.now(datetime.timezone.utc).timestamp() // 60)
+
+def epoch_minute_datetime(epoch_minute: int) -> datetime.datetime:
+    return datetime.datetime.fromtimestamp(epoch_minute * 60, datetime.timezone.utc)
+
+def bucket_run_id(epoch_minute: int) -> str:
+    return "daily:" + epoch_minute_datetime(epoch_minute).strftime(RUN_ID_FORMAT)
+
+def parse_bucket_run_id(run_id: str):
+    # daily:ГГГГ-ММ-ДД:ЧЧ:ММ -> минута эпохи; None для рассылок старого формата (daily:ГГГГ-ММ-ДД)
+    try:
+        value = datetime.datetime.strptime(run_id.split(":", 1)[1], RUN_ID_FORMAT)
+    except (IndexError, ValueError):
+        return None
+    return int(value.replace(tzinfo=datetime.timezone.utc).timestamp() // 60)
@@ -0,0 +1,158 @@
+import asyncio
+import collections
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+import metrics
+import tracing
+from config import LOOP_LAG_INTERVAL, LOOP_STALL_THRESHOLD, PROFILE_INTERVAL, PROFILE_DIR
+
+logger = logging.getLogger(__name__)
+
+PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+def _frames(frame) -> list:
+    # Кадры от внешнего к внутреннему
+    frames = []
+    while frame is not None:
+        frames.append(frame)
+        frame = frame.f_back
+    return frames[::-1]
+
+def culprit(frame) -> str:
+    """Обработчик (или ближайшая функция бота), в котором стоит поток цикла событий."""
+    frames = _frames(frame)
+    handlers = {trace.handler for trace in list(tracing.active.values())}
+    for f in reversed(frames):
+        if f.f_code.co_name in handlers:
+            return f.f_code.co_name
+    for f in reversed(frames):
+        filename = f.f_code.co_filename
+        if filename.startswith(PROJECT_DIR) and not filename.endswith("diagnostics.py"):
+            return f"{os.path.basename(filename)}:{f.f_code.co_name}"
+    return "unknown"
+
+class LoopMonitor:
+    """Замер задержки цикла событий и сторож, снимающий стек потока цикла при зависании.
+
+    Замер — задача в самом цикле: насколько позже положенного она просыпается.
+    Сторож — отдельный поток: если задача давно не отмечалась, цикл занят синхронным кодом.
+    """
+
+    def __init__(self, interval: float = LOOP_LAG_INTERVAL, stall_threshold: float = LOOP_STALL_THRESHOLD):
+        self.interval = interval
+        self.stall_threshold = stall_threshold
+        self.heartbeat = time.monotonic()
+        self._thread_id = None
+        self._task = None
+        self._stopped = threading.Event()
+
+    def start(self):
+        self._thread_id = threading.get_ident()
+        self.heartbeat = time.monotonic()
+        self._task = asyncio.get_running_loop().create_task(self._sample())
+        threading.Thread(target=self._watch, name="loop-watchdog", daemon=True).start()
+        logger.info("Диагностика цикла событий включена")
+
+    async def _sample(self):
+        while True:
+            expected = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            self.heartbeat = now
+            metrics.LOOP_LAG.observe(max(0.0, now - expected))
+
+    def _watch(self):
+        reported = False
+        while not self._stopped.wait(self.interval):
+            stalled = time.monotonic() - self.heartbeat
+            if stalled < self.interval + self.stall_threshold:
+                reported = False
+                continue
+            if reported:
+                continue
+            # Один отчёт на зависание: стек снимается, пока цикл ещё занят
+            reported = True
+            frame = sys._current_frames().get(self._thread_id)
+            if frame is None:
+                continue
+            handler = culprit(frame)
+            metrics.LOOP_STALLS.labels(handler=handler).inc()
+            stack = "".join(traceback.format_stack(frame)[-12:])
+            logger.warning(f"Цикл событий заблокирован {stalled:.2f} с в {handler}:\n{stack}")
+
+    async def stop(self):
+        self._stopped.set()
+        if self._task is not None:
+            self._task.cancel()
+
+class SamplingProfiler:
+    """Выборочный профилировщик потока цикла событий; пишет свёрнутые стеки (формат flamegraph.pl)."""
+
+    def __init__(self, interval: float = PROFILE_INTERVAL):
+        self.interval = interval
+        self.samples = collections.Counter()
+        self._thread_id = None
+        self._thread = None
+        self._stopped = threading.Event()
+        self.started_at = 0.0
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, thread_id: int):
+        if self.running:
+            return False
+        self._thread_id = thread_id
+        self.samples.clear()
+        self._stopped.clear()
+        self.started_at = time.time()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+        return True
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(self._thread_id)
+            if frame is None:
+                continue
+            stack = ";".join(
+                f"{f.f_code.co_name} ({os.path.basename(f.f_code.co_filename)}:{f.f_code.co_firstlineno})"
+                for f in _frames(frame)
+            )
+            self.samples[stack] += 1
+
+    def stop(self):
+        """Останавливает профилирование и возвращает путь к файлу со свёрнутыми стеками."""
+        if self._thread is None:
+            return None
+        self._stopped.set()
+        self._thread.join()
+        self._thread = None
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        path = os.path.join(PROFILE_DIR, f"profile-{int(self.started_at)}.folded")
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, count in self.samples.most_common():
+                f.write(f"{stack} {count}\n")
+        logger.info(f"Профиль записан: {path}, {sum(self.samples.values())} выборок")
+        return path
+
+monitor = LoopMonitor()
+profiler = SamplingProfiler()
+# Поток цикла событий; запоминается при старте приложения
+loop_thread_id = None
+
+def start(enabled: bool):
+    global loop_thread_id
+    loop_thread_id = threading.get_ident()
+    if enabled:
+        monitor.start()
+
+async def stop():
+    await monitor.stop()
+    if profiler.running:
+        profiler.stop()
@@ -0,0 +1,45 @@
+import asyncio
+import contextlib
+import logging
+import tempfile
+from http_client import get_client
+from config import (
+    DOWNLOAD_CONCURRENCY,
+    DOWNLOAD_SPOOL_THRESHOLD,
+    DOWNLOAD_MAX_BYTES,
+    DOWNLOAD_CHUNK_SIZE,
+)
+
+logger = logging.getLogger(__name__)
+
+# Общий лимит одновременных скачиваний (держится до конца отправки в Telegram)
+_semaphore = asyncio.Semaphore(DOWNLOAD_CONCURRENCY)
+
+class DownloadTooLarge(Exception):
+    pass
+
+@contextlib.asynccontextmanager
+async def open_download(url: str):
+    """Скачивает url потоком во временный файл и отдаёт его, перемотанный на начало.
+
+    До DOWNLOAD_SPOOL_THRESHOLD байт файл живёт в памяти, дальше уходит на диск.
+    При ответе не 200 отдаёт None, при превышении DOWNLOAD_MAX_BYTES бросает DownloadTooLarge.
+    """
+    async with _semaphore:
+        with tempfile.SpooledTemporaryFile(max_size=DOWNLOAD_SPOOL_THRESHOLD) as spool:
+            async with get_client().stream("GET", url) as response:
+                if response.status_code != 200:
+                    logger.error(f"Ошибка скачивания {url}: {response.status_code}")
+                    yield None
+                    return
+                declared = int(response.headers.get("Content-Length") or 0)
+                if declared > DOWNLOAD_MAX_BYTES:
+                    raise DownloadTooLarge(f"{declared} байт")
+                size = 0
+                async for chunk in response.aiter_bytes(DOWNLOAD_CHUNK_SIZE):
+                    size += len(chunk)
+                    if size > DOWNLOAD_MAX_BYTES:
+                        raise DownloadTooLarge(f"больше {DOWNLOAD_MAX_BYTES} байт")
+                    spool.write(chunk)
+            spool.seek(0)
+            yield spool
@@ -0,0 +1,86 @@
+import logging
+from telegram import InputMediaPhoto
+from telegram.error import BadRequest
+import database
+from utils.lru import LRUCache
+import metrics
+import renditions
+from config import FILE_ID_CACHE_SIZE
+
+logger = logging.getLogger(__name__)
+
+# Горячие file_id держим в памяти, полный кэш — в SQLite
+_memory = LRUCache(FILE_ID_CACHE_SIZE)
+# Запоминаем отсутствие записи, чтобы не ходить в БД за каждой новой фоткой
+_MISSING = ""
+
+async def get_file_id(photo_id: str, rendition: str):
+    if not photo_id:
+        return None
+    key = (photo_id, rendition)
+    file_id = _memory.get(key)
+    if file_id is None:
+        file_id = await database.get_file_id(photo_id, rendition) or _MISSING
+        _memory.set(key, file_id)
+    if file_id:
+        metrics.cache_hit("telegram_file_id")
+    else:
+        metrics.cache_miss("telegram_file_id")
+    return file_id or None
+
+async def remember(photo_id: str, rendition: str, file_id: str):
+    if not photo_id or not file_id:
+        return
+    _memory.set((photo_id, rendition), file_id)
+    await database.set_file_id(photo_id, rendition, file_id)
+
+async def forget(photo_id: str, rendition: str):
+    _memory.set((photo_id, rendition), _MISSING)
+    await database.delete_file_id(photo_id, rendition)
+
+def _largest_file_id(message):
+    if message is not None and message.photo:
+        return message.photo[-1].file_id
+    return None
+
+async def send_photo(send, photo_id: str, rendition: str, url: str, **kwargs):
+    """Отправляет фото через send(photo=..., **kwargs), по возможности по file_id.
+
+    send — reply_photo сообщения или bot.send_photo с привязанным chat_id.
+    """
+    file_id = await get_file_id(photo_id, rendition)
+    if file_id:
+        try:
+            return await send(photo=file_id, **kwargs)
+        except BadRequest as e:
+            # file_id мог устареть — отправляем по URL и перезаписываем кэш
+            logger.warning(f"file_id для {photo_id}/{rendition} не принят: {e}")
+            await forget(photo_id, rendition)
+    message = await send(photo=url, **kwargs)
+    await remember(photo_id, rendition, _largest_file_id(message))
+    return message
+
+async def send_rendition(send, photo, rendition: str, **kwargs):
+    # Ключ кэша и ссылка всегда берутся из одной пары (photo.id, rendition)
+    return await send_photo(send, photo.id, rendition, renditions.url(photo, rendition), **kwargs)
+
+async def send_media_group(bot, chat_id: int, items: list, rendition: str, **kwargs):
+    """items — список пар (photo_id, url) в порядке отображения."""
+    cached = [await get_file_id(photo_id, rendition) for photo_id, _ in items]
+    media = [InputMediaPhoto(media=file_id or url) for file_id, (_, url) in zip(cached, items)]
+    try:
+        messages = await bot.send_media_group(chat_id=chat_id, media=media, **kwargs)
+    except BadRequest as e:
+        if not any(cached):
+            raise
+        logger.warning(f"file_id в альбоме не приняты: {e}")
+        for (photo_id, _), file_id in zip(items, cached):
+            if file_id:
+                await forget(photo_id, rendition)
+        media = [InputMediaPhoto(media=url) for _, url in items]
+        cached = [None] * len(items)
+        messages = await bot.send_media_group(chat_id=chat_id, media=media, **kwargs)
+    for (photo_id, _), file_id, message in zip(items, cached, messages):
+        if not file_id:
+            await remember(photo_id, rendition, _largest_file_id(message))
+    return messages
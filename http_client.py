@@ -0,0 +1,58 @@
+import logging
+import httpx
+from config import (
+    HTTP_MAX_CONNECTIONS,
+    HTTP_MAX_KEEPALIVE_CONNECTIONS,
+    HTTP_KEEPALIVE_EXPIRY,
+    HTTP_CONNECT_TIMEOUT,
+    HTTP_READ_TIMEOUT,
+    HTTP_POOL_TIMEOUT,
+    HTTP2_ENABLED,
+)
+
+logger = logging.getLogger(__name__)
+
+# Единый клиент на всё приложение: держим соединения с api.unsplash.com
+# и images.unsplash.com открытыми, чтобы не платить за TCP/TLS на каждый запрос.
+_client = None
+
+def create_client() -> httpx.AsyncClient:
+    limits = httpx.Limits(
+        max_connections=HTTP_MAX_CONNECTIONS,
+        max_keepalive_connections=HTTP_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+    )
+    timeout = httpx.Timeout(
+        HTTP_READ_TIMEOUT,
+        connect=HTTP_CONNECT_TIMEOUT,
+        pool=HTTP_POOL_TIMEOUT,
+    )
+    return httpx.AsyncClient(http2=HTTP2_ENABLED, limits=limits, timeout=timeout, follow_redirects=True)
+
+async def init_client() -> httpx.AsyncClient:
+    global _client
+    if _client is None or _client.is_closed:
+        _client = create_client()
+        logger.info(
+            f"HTTP-клиент создан (http2={HTTP2_ENABLED}, max_connections={HTTP_MAX_CONNECTIONS})"
+        )
+    return _client
+
+def get_client() -> httpx.AsyncClient:
+    # Ленивая инициализация на случай вызова вне жизненного цикла Application
+    global _client
+    if _client is None or _client.is_closed:
+        _client = create_client()
+    return _client
+
+def set_client(client: httpx.AsyncClient):
+    # Подмена клиента (например, на httpx.MockTransport в бенчмарках)
+    global _client
+    _client = client
+
+async def close_client():
+    global _client
+    if _client is not None and not _client.is_closed:
+        await _client.aclose()
+        logger.info("HTTP-клиент закрыт")
+    _client = None
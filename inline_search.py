@@ -0,0 +1,120 @@
+import asyncio
+import logging
+from telegram import InlineQueryResultPhoto
+from telegram.error import BadRequest
+from search_cache import get_search_page, prefetch_page, normalize_query
+from unsplash_scheduler import Priority
+from utils.lru import LRUCache
+from models import SearchPage
+import metrics
+import renditions
+from config import (
+    INLINE_CACHE_TIME,
+    INLINE_PREFIX_CACHE_TIME,
+    INLINE_DEBOUNCE,
+    INLINE_MIN_QUERY_LENGTH,
+    INLINE_RESULTS_CACHE_SIZE,
+)
+
+logger = logging.getLogger(__name__)
+
+# Inline-поиск общий для всех: без личных настроек, чтобы один ответ подходил любому пользователю
+INLINE_SETTINGS = {"orientation": "any", "color": "any", "order_by": "relevant"}
+
+# (запрос, страница) -> (SearchPage, готовый список InlineQueryResultPhoto)
+_results = LRUCache(INLINE_RESULTS_CACHE_SIZE)
+# user_id -> id последнего inline-запроса пользователя (для отбрасывания промежуточных)
+_latest = {}
+# Запросы, которые прогреваются в фоне после ответа по префиксу
+_warming = {}
+
+def parse_offset(offset: str) -> int:
+    # offset — номер страницы поиска; пустой для первой
+    return int(offset) if offset.isdigit() and int(offset) > 0 else 1
+
+def build_results(page: SearchPage) -> list:
+    results = []
+    for photo in page.photos:
+        photo_url = renditions.url(photo, renditions.PREVIEW)
+        if photo_url:
+            results.append(InlineQueryResultPhoto(
+                id=photo.id,
+                photo_url=photo_url,
+                thumbnail_url=renditions.url(photo, renditions.THUMB) or photo_url,
+                caption=photo.caption,
+            ))
+    return results
+
+async def get_results(query: str, page_number: int, priority: Priority = Priority.INTERACTIVE):
+    page = await get_search_page(query, page_number, INLINE_SETTINGS, priority=priority)
+    if page is None:
+        return None, None
+    key = (query, page_number)
+    cached = _results.get(key)
+    # Список пересобирается только когда кэш поиска отдал другую (обновлённую) страницу
+    if cached is not None and cached[0] is page:
+        metrics.cache_hit("inline_results")
+        return page, cached[1]
+    metrics.cache_miss("inline_results")
+    results = build_results(page)
+    _results.set(key, (page, results))
+    return page, results
+
+def prefix_results(query: str):
+    """Ответ из уже готовой первой страницы более короткого запроса («mount» для «mountain»).
+
+    Фото отбираются по вхождению всех слов запроса в подпись; None — подходящего префикса нет.
+    """
+    words = query.split()
+    for end in range(len(query) - 1, INLINE_MIN_QUERY_LENGTH - 1, -1):
+        cached = _results.get((query[:end].rstrip(), 1))
+        if cached is None:
+            continue
+        matched = [result for result in cached[1] if all(word in result.caption.lower() for word in words)]
+        return matched or None
+    return None
+
+def _warm(query: str):
+    if query in _warming:
+        return
+    task = asyncio.create_task(get_results(query, 1, priority=Priority.GALLERY_PREFETCH))
+    _warming[query] = task
+    task.add_done_callback(lambda _: _warming.pop(query, None))
+
+async def _answer(inline_query, results: list, cache_time: int, next_offset: str = None):
+    try:
+        await inline_query.answer(results, cache_time=cache_time, is_personal=False, next_offset=next_offset)
+    except BadRequest as e:
+        # Запрос мог устареть, пока ждали Unsplash
+        logger.debug(f"Inline-ответ не принят: {e}")
+
+async def answer_inline_query(inline_query):
+    query = normalize_query(inline_query.query)
+    if len(query) < INLINE_MIN_QUERY_LENGTH:
+        await _answer(inline_query, [], INLINE_CACHE_TIME)
+        return
+    page_number = parse_offset(inline_query.offset)
+    if page_number == 1 and _results.get((query, 1)) is None:
+        matched = prefix_results(query)
+        if matched:
+            # Отвечаем сразу из префикса, полный запрос догружаем в фоне
+            metrics.cache_hit("inline_prefix")
+            await _answer(inline_query, matched, INLINE_PREFIX_CACHE_TIME)
+            _warm(query)
+            return
+        # Запросы летят на каждое нажатие клавиши: ждём паузы и отвечаем только на последний
+        user_id = inline_query.from_user.id
+        _latest[user_id] = inline_query.id
+        await asyncio.sleep(INLINE_DEBOUNCE)
+        if _latest.get(user_id) != inline_query.id:
+            return
+        del _latest[user_id]
+    page, results = await get_results(query, page_number)
+    if page is None:
+        # Unsplash недоступен — пустой ответ кэшируем ненадолго
+        await _answer(inline_query, [], INLINE_PREFIX_CACHE_TIME)
+        return
+    has_next = page_number < page.total_pages
+    await _answer(inline_query, results, INLINE_CACHE_TIME, next_offset=str(page_number + 1) if has_next else "")
+    if has_next:
+        prefetch_page(query, page_number + 1, INLINE_SETTINGS)
@@ -0,0 +1,145 @@
+import functools
+import inspect
+import logging
+import time
+from prometheus_client import Counter, Gauge, Histogram, start_http_server
+from telegram.ext import ConversationHandler
+from telegram.request import BaseRequest
+import tracing
+
+logger = logging.getLogger(__name__)
+
+HANDLER_LATENCY = Histogram(
+    "bot_handler_latency_seconds", "Время работы обработчика апдейта", ["handler"]
+)
+HANDLER_ERRORS = Counter(
+    "bot_handler_errors_total", "Исключения в обработчиках", ["handler"]
+)
+UNSPLASH_LATENCY = Histogram(
+    "unsplash_request_latency_seconds", "Время запроса к Unsplash API", ["endpoint"]
+)
+UNSPLASH_REQUESTS = Counter(
+    "unsplash_requests_total", "Запросы к Unsplash API по статусу ответа", ["endpoint", "status"]
+)
+UNSPLASH_QUOTA_REMAINING = Gauge(
+    "unsplash_quota_remaining", "Остаток часовой квоты Unsplash (X-Ratelimit-Remaining)"
+)
+UNSPLASH_COALESCE_LEADERS = Counter(
+    "unsplash_coalesce_leaders_total", "Запросы к Unsplash, ушедшие в API от имени склеенной группы"
+)
+UNSPLASH_COALESCED = Counter(
+    "unsplash_coalesced_total", "Запросы к Unsplash, присоединившиеся к уже идущему одинаковому"
+)
+UNSPLASH_QUEUE_DEPTH = Gauge(
+    "unsplash_scheduler_queue_depth", "Запросы к Unsplash, ожидающие слота"
+)
+CACHE_REQUESTS = Counter(
+    "bot_cache_requests_total", "Обращения к кэшам", ["cache", "result"]
+)
+TELEGRAM_LATENCY = Histogram(
+    "telegram_request_latency_seconds", "Время запроса к Bot API", ["method"]
+)
+TELEGRAM_ERRORS = Counter(
+    "telegram_request_errors_total", "Ошибки Bot API", ["method", "status"]
+)
+NOTIFY_PROGRESS = Gauge(
+    "daily_notification_progress", "Прогресс текущей рассылки", ["state"]
+)
+NOTIFY_LAST_DURATION = Gauge(
+    "daily_notification_last_duration_seconds", "Длительность последней рассылки"
+)
+
+LOOP_LAG = Histogram(
+    "bot_event_loop_lag_seconds", "Задержка пробуждения задач в цикле событий",
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0),
+)
+LOOP_STALLS = Counter(
+    "bot_event_loop_stalls_total", "Блокировки цикла событий синхронным кодом", ["handler"]
+)
+
+def cache_hit(cache: str):
+    CACHE_REQUESTS.labels(cache=cache, result="hit").inc()
+
+def cache_miss(cache: str):
+    CACHE_REQUESTS.labels(cache=cache, result="miss").inc()
+
+def start_metrics_server(port: int):
+    start_http_server(port)
+    logger.info(f"Метрики Prometheus доступны на порту {port}")
+
+def bind_scheduler(scheduler):
+    # Значения считываются в момент сбора метрик
+    UNSPLASH_QUOTA_REMAINING.set_function(lambda: scheduler.remaining)
+    UNSPLASH_QUEUE_DEPTH.set_function(lambda: scheduler.stats()["queue_depth"])
+
+def _instrument_callback(callback, name: str):
+    @functools.wraps(callback)
+    async def wrapper(update, context):
+        started = time.perf_counter()
+        try:
+            with tracing.trace_update(name, update):
+                result = callback(update, context)
+                if inspect.isawaitable(result):
+                    result = await result
+            return result
+        except Exception:
+            HANDLER_ERRORS.labels(handler=name).inc()
+            raise
+        finally:
+            HANDLER_LATENCY.labels(handler=name).observe(time.perf_counter() - started)
+    return wrapper
+
+def _instrument_handler(handler):
+    if isinstance(handler, ConversationHandler):
+        for inner in handler.entry_points + handler.fallbacks:
+            _instrument_handler(inner)
+        for state_handlers in handler.states.values():
+            for inner in state_handlers:
+                _instrument_handler(inner)
+        return
+    callback = handler.callback
+    if getattr(callback, "__instrumented__", False):
+        return
+    name = getattr(callback, "__name__", type(handler).__name__)
+    if name == "<lambda>":
+        name = f"{type(handler).__name__}_lambda"
+    wrapper = _instrument_callback(callback, name)
+    wrapper.__instrumented__ = True
+    handler.callback = wrapper
+
+def instrument_handlers(application):
+    """Оборачивает колбэки всех зарегистрированных обработчиков замером времени."""
+    for handlers in application.handlers.values():
+        for handler in handlers:
+            _instrument_handler(handler)
+
+class InstrumentedRequest(BaseRequest):
+    """Обёртка над транспортом Bot API: время и ошибки по методам."""
+
+    def __init__(self, inner: BaseRequest):
+        self.inner = inner
+
+    @property
+    def read_timeout(self):
+        return self.inner.read_timeout
+
+    async def initialize(self):
+        await self.inner.initialize()
+
+    async def shutdown(self):
+        await self.inner.shutdown()
+
+    async def do_request(self, url, method, request_data=None, **kwargs):
+        api_method = url.rsplit("/", 1)[-1]
+        started = time.perf_counter()
+        try:
+            with tracing.span("telegram", api_method):
+                status, payload = await self.inner.do_request(url, method, request_data=request_data, **kwargs)
+        except Exception as e:
+            TELEGRAM_ERRORS.labels(method=api_method, status=type(e).__name__).inc()
+            raise
+        finally:
+            TELEGRAM_LATENCY.labels(method=api_method).observe(time.perf_counter() - started)
+        if status != 200:
+            TELEGRAM_ERRORS.labels(method=api_method, status=str(status)).inc()
+        return status, payload
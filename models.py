@@ -0,0 +1,73 @@
+import time
+
+class Photo:
+    """Компактная запись о фото: только то, что бот реально использует из ответа Unsplash."""
+
+    __slots__ = ("id", "raw", "full", "regular", "small", "description", "author")
+
+    def __init__(self, id: str, raw: str = None, full: str = None, regular: str = None, small: str = None,
+                 description: str = None, author: str = None):
+        self.id = id
+        self.raw = raw
+        self.full = full
+        self.regular = regular
+        self.small = small
+        self.description = description
+        self.author = author
+
+    @classmethod
+    def from_api(cls, data: dict) -> "Photo":
+        urls = data.get("urls") or {}
+        raw = urls.get("raw")
+        # Размеры строятся из raw (renditions.py); готовые regular/small нужны только без него
+        return cls(
+            id=data.get("id"),
+            raw=raw,
+            full=urls.get("full"),
+            regular=None if raw else urls.get("regular"),
+            small=None if raw else urls.get("small"),
+            description=data.get("description") or data.get("alt_description"),
+            author=(data.get("user") or {}).get("name"),
+        )
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "Photo":
+        return cls(**{name: data.get(name) for name in cls.__slots__})
+
+    def to_dict(self) -> dict:
+        return {name: getattr(self, name) for name in self.__slots__ if getattr(self, name) is not None}
+
+    @property
+    def caption(self) -> str:
+        return f"{self.description or 'Без описания'}\nАвтор: {self.author or 'Неизвестно'}"
+
+    def __repr__(self):
+        return f"Photo({self.id!r})"
+
+class SearchPage:
+    """Страница результатов поиска: общее число страниц, компактные фото и время получения из API."""
+
+    __slots__ = ("total_pages", "photos", "fetched_at")
+
+    def __init__(self, total_pages: int, photos: list, fetched_at: float = 0.0):
+        self.total_pages = total_pages
+        self.photos = photos
+        self.fetched_at = fetched_at
+
+    @classmethod
+    def from_api(cls, data: dict) -> "SearchPage":
+        return cls(data.get("total_pages", 1), [Photo.from_api(item) for item in data.get("results") or []],
+                   time.time())
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "SearchPage":
+        # Записи без fetched_at (старый формат) считаются устаревшими и обновятся при первом чтении
+        return cls(data.get("total_pages", 1), [Photo.from_dict(item) for item in data.get("photos") or []],
+                   data.get("fetched_at", 0.0))
+
+    def to_dict(self) -> dict:
+        return {
+            "total_pages": self.total_pages,
+            "photos": [photo.to_dict() for photo in self.photos],
+            "fetched_at": self.fetched_at,
+        }
@@ -0,0 +1,216 @@
+import asyncio
+import datetime
+import logging
+import time
+from telegram.error import RetryAfter, Forbidden, BadRequest, TimedOut, NetworkError
+import database
+import metrics
+from config import (
+    NOTIFY_CONCURRENCY,
+    NOTIFY_RATE,
+    NOTIFY_CHAT_INTERVAL,
+    NOTIFY_GROUP_INTERVAL,
+    NOTIFY_MAX_RETRIES,
+)
+
+logger = logging.getLogger(__name__)
+
+class TokenBucket:
+    """Глобальный ограничитель скорости: rate токенов в секунду, не больше capacity подряд."""
+
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = asyncio.Lock()
+
+    def pause(self, seconds: float):
+        # После 429 притормаживаем всех воркеров, а не только получившего ошибку
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    await asyncio.sleep(self.paused_until - now)
+                    continue
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+# Лимит Bot API общий для бота, поэтому и ограничитель один на процесс: параллельные рассылки
+# (корзина и досылка прерванной) делят скорость, а пауза после 429 останавливает их все
+bucket = TokenBucket(NOTIFY_RATE)
+
+class PerChatLimiter:
+    """Минимальный интервал между сообщениями в один чат (для групп — реже)."""
+
+    def __init__(self, chat_interval: float, group_interval: float):
+        self.chat_interval = chat_interval
+        self.group_interval = group_interval
+        self.next_allowed = {}
+
+    async def acquire(self, chat_id: int):
+        interval = self.group_interval if chat_id < 0 else self.chat_interval
+        now = time.monotonic()
+        slot = max(now, self.next_allowed.get(chat_id, 0.0))
+        self.next_allowed[chat_id] = slot + interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+class DeliveryStats:
+    def __init__(self, run_id: str):
+        self.run_id = run_id
+        self.total = 0
+        self.skipped = 0
+        self.sent = 0
+        self.failed = 0
+        self.blocked = 0
+        self.retries = 0
+        self.started = time.monotonic()
+        self.duration = 0.0
+
+    def publish(self):
+        for state in ("total", "skipped", "sent", "failed", "blocked"):
+            metrics.NOTIFY_PROGRESS.labels(state=state).set(getattr(self, state))
+
+    def as_dict(self) -> dict:
+        return {
+            "total": self.total,
+            "skipped": self.skipped,
+            "sent": self.sent,
+            "failed": self.failed,
+            "blocked": self.blocked,
+            "retries": self.retries,
+            "duration": round(self.duration, 2),
+        }
+
+    def __str__(self):
+        return ", ".join(f"{k}={v}" for k, v in self.as_dict().items())
+
+def retry_after_seconds(error: RetryAfter) -> float:
+    delay = error.retry_after
+    if isinstance(delay, datetime.timedelta):
+        return delay.total_seconds()
+    return float(delay)
+
+async def run_delivery(run_id: str, recipients, deliver, concurrency: int = NOTIFY_CONCURRENCY,
+                       day: int = None) -> DeliveryStats:
+    """Рассылает deliver(user_id, chat_id) по recipients с ограничением скорости.
+
+    Прогресс хранится в БД по run_id: при повторном запуске с тем же run_id
+    уже получившие сообщение пользователи пропускаются. day — сутки UTC ежедневной
+    рассылки, отмечаются у подписчика вместе с доставкой.
+    """
+    stats = DeliveryStats(run_id)
+    await database.start_notification_run(run_id)
+    delivered = await database.get_delivered_users(run_id)
+    chat_limiter = PerChatLimiter(NOTIFY_CHAT_INTERVAL, NOTIFY_GROUP_INTERVAL)
+    queue = asyncio.Queue(maxsize=concurrency * 2)
+    # Доставки пишутся в БД сразу после отправки: пока идёт одна запись, следующие копятся
+    # и уходят следующей транзакцией, так что после падения повторно уйдут единицы сообщений
+    pending = []
+    progress_ready = asyncio.Event()
+    closing = False
+
+    def mark_progress(user_id: int):
+        pending.append(user_id)
+        progress_ready.set()
+
+    async def write_progress():
+        while True:
+            await progress_ready.wait()
+            progress_ready.clear()
+            if pending:
+                user_ids = pending[:]
+                pending.clear()
+                try:
+                    await database.mark_delivered(run_id, user_ids, day)
+                except Exception as e:
+                    logger.error(f"Не удалось записать прогресс рассылки {run_id}: {e}")
+                    pending[:0] = user_ids
+                    if closing:
+                        return
+            if closing and not pending:
+                return
+
+    async def send_one(user_id: int, chat_id: int):
+        for attempt in range(NOTIFY_MAX_RETRIES + 1):
+            await bucket.acquire()
+            await chat_limiter.acquire(chat_id)
+            try:
+                await deliver(user_id, chat_id)
+                stats.sent += 1
+                mark_progress(user_id)
+                return
+            except RetryAfter as e:
+                delay = retry_after_seconds(e)
+                logger.warning(f"Telegram просит подождать {delay} с (пользователь {user_id})")
+                bucket.pause(delay)
+                stats.retries += 1
+            except Forbidden:
+                # Пользователь заблокировал бота — больше ему не пишем
+                stats.blocked += 1
+                await database.remove_subscription(user_id)
+                mark_progress(user_id)
+                return
+            except BadRequest as e:
+                logger.error(f"Telegram отклонил уведомление пользователю {user_id}: {e}")
+                break
+            except (TimedOut, NetworkError):
+                stats.retries += 1
+                await asyncio.sleep(2 ** attempt)
+            except Exception as e:
+                logger.error(f"Ошибка отправки уведомления пользователю {user_id}: {e}")
+                break
+        stats.failed += 1
+
+    async def worker():
+        while True:
+            item = await queue.get()
+            try:
+                if item is None:
+                    return
+                await send_one(*item)
+                stats.publish()
+            finally:
+                queue.task_done()
+
+    async def enqueue(user_id: int, chat_id: int):
+        stats.total += 1
+        if user_id in delivered:
+            stats.skipped += 1
+            return
+        await queue.put((user_id, chat_id))
+
+    writer = asyncio.create_task(write_progress())
+    workers = [asyncio.create_task(worker()) for _ in range(concurrency)]
+    try:
+        # recipients — список или асинхронный итератор (порции из БД читаются по мере отправки)
+        if hasattr(recipients, "__aiter__"):
+            async for user_id, chat_id in recipients:
+                await enqueue(user_id, chat_id)
+        else:
+            for user_id, chat_id in recipients:
+                await enqueue(user_id, chat_id)
+        for _ in workers:
+            await queue.put(None)
+        await asyncio.gather(*workers)
+    finally:
+        for task in workers:
+            task.cancel()
+        closing = True
+        progress_ready.set()
+        await writer
+    stats.duration = time.monotonic() - stats.started
+    stats.publish()
+    metrics.NOTIFY_LAST_DURATION.set(stats.duration)
+    await database.finish_notification_run(run_id, stats.as_dict())
+    logger.info(f"Рассылка {run_id} завершена: {stats}")
+    return stats
@@ -0,0 +1,159 @@
+import asyncio
+import logging
+import random
+import time
+from collections import deque
+from unsplash_client import get_random_photos
+from unsplash_scheduler import Priority
+import metrics
+from models import Photo
+from config import (
+    RANDOM_POOL_SIZE,
+    RANDOM_POOL_LOW_WATERMARK,
+    RANDOM_POOL_IDLE_TTL,
+    RANDOM_POOL_STALE_SIZE,
+)
+
+logger = logging.getLogger(__name__)
+
+# Unsplash отдаёт не больше 30 фото за один запрос /photos/random?count=N
+MAX_BATCH = 30
+
+def settings_key(settings: dict) -> tuple:
+    return (settings.get("orientation", "any"), settings.get("color", "any"))
+
+def key_params(key: tuple) -> dict:
+    orientation, color = key
+    params = {}
+    if orientation != "any":
+        params["orientation"] = orientation
+    if color != "any":
+        params["color"] = color
+    return params
+
+class PhotoPool:
+    def __init__(self, key: tuple, capacity: int, stale_size: int = RANDOM_POOL_STALE_SIZE):
+        self.key = key
+        self.photos = deque(maxlen=capacity)
+        # Последние выданные фото: запасной вариант, когда пул пуст, а Unsplash не отвечает
+        self.recent = deque(maxlen=stale_size)
+        self.lock = asyncio.Lock()
+        self.last_used = time.monotonic()
+        self.refill_task = None
+        # Время последнего пополнения (по часам, а не monotonic: переживает перезапуск в снимке)
+        self.refilled_at = 0.0
+
+class RandomPhotoPools:
+    """Пулы предзагруженных случайных фото, по одному на ключ (orientation, color)."""
+
+    def __init__(self, capacity: int = RANDOM_POOL_SIZE, low_watermark: int = RANDOM_POOL_LOW_WATERMARK,
+                 idle_ttl: float = RANDOM_POOL_IDLE_TTL):
+        self.capacity = capacity
+        self.low_watermark = min(low_watermark, capacity)
+        self.idle_ttl = idle_ttl
+        self._pools = {}
+
+    def _get_pool(self, key: tuple) -> PhotoPool:
+        pool = self._pools.get(key)
+        if pool is None:
+            pool = PhotoPool(key, self.capacity)
+            self._pools[key] = pool
+        pool.last_used = time.monotonic()
+        return pool
+
+    async def get(self, settings: dict, priority: Priority = Priority.INTERACTIVE, accept=None):
+        """Фото из пула; accept(photo) -> bool отбирает подходящие, отвергнутые остаются в пуле для других."""
+        pool = self._get_pool(settings_key(settings))
+        photo = self._take(pool, accept)
+        if photo is not None:
+            metrics.cache_hit("random_pool")
+        else:
+            metrics.cache_miss("random_pool")
+            # Подходящих нет — ждём пополнения; параллельные запросы делят один вызов API
+            if len(pool.photos) < self.capacity:
+                await self._refill(pool, threshold=len(pool.photos) + 1, priority=priority)
+            # Если все фото пользователь уже видел, повтор лучше, чем ошибка
+            photo = self._take(pool, accept) or self._take(pool, None)
+        if photo is None and pool.recent:
+            # Свежих нет (квота или сбой Unsplash) — лучше повтор, чем ошибка
+            metrics.cache_hit("random_pool_stale")
+            photo = random.choice(pool.recent)
+        self._maybe_refill(pool)
+        return photo
+
+    @staticmethod
+    def _take(pool: PhotoPool, accept=None):
+        for i, photo in enumerate(pool.photos):
+            if accept is None or accept(photo):
+                del pool.photos[i]
+                pool.recent.append(photo)
+                return photo
+        return None
+
+    def _maybe_refill(self, pool: PhotoPool):
+        if len(pool.photos) >= self.low_watermark:
+            return
+        if pool.refill_task is not None and not pool.refill_task.done():
+            return
+        pool.refill_task = asyncio.create_task(
+            self._refill(pool, threshold=self.low_watermark, priority=Priority.POOL_REFILL)
+        )
+
+    async def _refill(self, pool: PhotoPool, threshold: int, priority: Priority):
+        async with pool.lock:
+            # Пока ждали блокировку, пул мог пополнить кто-то другой
+            if len(pool.photos) >= threshold:
+                return
+            count = min(self.capacity - len(pool.photos), MAX_BATCH)
+            photos = await get_random_photos(count=count, priority=priority, **key_params(pool.key))
+            if not photos:
+                return
+            known = {p.id for p in pool.photos}
+            for item in photos:
+                photo = Photo.from_api(item)
+                if photo.id not in known:
+                    pool.photos.append(photo)
+                    known.add(photo.id)
+            pool.refilled_at = time.time()
+            logger.debug(f"Пул {pool.key} пополнен: {len(pool.photos)} фото")
+
+    def snapshot(self) -> list:
+        return [
+            {
+                "key": list(pool.key),
+                "refilled_at": pool.refilled_at,
+                "photos": [photo.to_dict() for photo in pool.photos],
+                "recent": [photo.to_dict() for photo in pool.recent],
+            }
+            for pool in self._pools.values() if pool.photos or pool.recent
+        ]
+
+    def restore(self, entries: list, max_age: float) -> int:
+        """Восстанавливает пулы из снимка (слишком старые пропускаются) и дозаполняет их в фоне."""
+        now = time.time()
+        restored = 0
+        for entry in entries:
+            pool = self._get_pool(tuple(entry["key"]))
+            if now - entry.get("refilled_at", 0) <= max_age:
+                pool.photos.extend(Photo.from_dict(item) for item in entry["photos"])
+                pool.refilled_at = entry["refilled_at"]
+                restored += len(pool.photos)
+            # Недавние фото годятся как запасной вариант при любом возрасте
+            pool.recent.extend(Photo.from_dict(item) for item in entry.get("recent", []))
+            self._maybe_refill(pool)
+        return restored
+
+    def evict_idle(self) -> int:
+        now = time.monotonic()
+        stale = [
+            key for key, pool in self._pools.items()
+            if now - pool.last_used > self.idle_ttl and not pool.lock.locked()
+        ]
+        for key in stale:
+            del self._pools[key]
+        if stale:
+            logger.info(f"Удалено неиспользуемых пулов случайных фото: {len(stale)}")
+        return len(stale)
+
+    def __len__(self):
+        return sum(len(pool.photos) for pool in self._pools.values())
@@ -1,27 +1,132 @@
+import hashlib
 import json
+import zlib
+import msgpack
 import redis.asyncio as aioredis
+from config import (
+    REDIS_URL,
+    REDIS_MAX_CONNECTIONS,
+    REDIS_SOCKET_TIMEOUT,
+    REDIS_COMPRESS_THRESHOLD,
+)
 
-# Подключение к Redis (при необходимости настройте host, port, db)
-redis_client = aioredis.Redis(host='localhost', port=6379, db=0)
+# Общий пул соединений; адрес и размер берутся из окружения
+pool = aioredis.ConnectionPool.from_url(
+    REDIS_URL,
+    max_connections=REDIS_MAX_CONNECTIONS,
+    socket_timeout=REDIS_SOCKET_TIMEOUT,
+    socket_connect_timeout=REDIS_SOCKET_TIMEOUT,
+    health_check_interval=30,
+)
+redis_client = aioredis.Redis(connection_pool=pool)
 
+# ------ Кодек значений ------
+# Первый байт — формат: msgpack как есть или msgpack, сжатый zlib (для больших значений)
+_PLAIN = b"\x00"
+_ZLIB = b"\x01"
+
+def encode(value) -> bytes:
+    packed = msgpack.packb(value, use_bin_type=True)
+    if len(packed) >= REDIS_COMPRESS_THRESHOLD:
+        return _ZLIB + zlib.compress(packed, 6)
+    return _PLAIN + packed
+
+def decode(data: bytes):
+    if not data:
+        return None
+    marker, body = data[:1], data[1:]
+    if marker == _ZLIB:
+        return msgpack.unpackb(zlib.decompress(body), raw=False)
+    if marker == _PLAIN:
+        return msgpack.unpackb(body, raw=False)
+    # Значения, записанные старой версией в JSON
+    return json.loads(data)
+
+# ------ Ключи ------
+def _digest(text: str) -> str:
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=12).hexdigest()
+
+def search_key(query: str, settings: dict, page: int) -> str:
+    return f"gs:{_digest(query + '|' + json.dumps(settings, sort_keys=True))}:{page}"
+
+def state_key(user_id: int) -> str:
+    return f"gst:{user_id}"
+
+def seen_key(user_id: int, generation: int) -> str:
+    return f"seen:{user_id}:{generation}"
+
+def chat_lock_key(chat_id: int) -> str:
+    return f"lock:chat:{chat_id}"
+
+INVALIDATION_CHANNEL = "db:invalidate"
+
+# ------ Результаты поиска ------
 async def cache_search_results(query: str, settings: dict, page: int, results: dict, ttl: int = 600):
-    key = f"gallery:{query}:{json.dumps(settings, sort_keys=True)}:page:{page}"
-    await redis_client.set(key, json.dumps(results), ex=ttl)
+    await redis_client.set(search_key(query, settings, page), encode(results), ex=ttl)
 
-async def get_cached_search_results(query: str, settings: dict, page: int):
-    key = f"gallery:{query}:{json.dumps(settings, sort_keys=True)}:page:{page}"
-    cached = await redis_client.get(key)
-    if cached:
-        return json.loads(cached)
-    return None
+async def get_search_pages(query: str, settings: dict, pages: list) -> list:
+    # Несколько страниц одним MGET; отсутствующие — None
+    values = await redis_client.mget([search_key(query, settings, page) for page in pages])
+    return [decode(value) for value in values]
 
+# ------ Состояние галереи ------
 async def cache_gallery_state(user_id: int, state: dict, ttl: int = 3600):
-    key = f"gallery_state:{user_id}"
-    await redis_client.set(key, json.dumps(state), ex=ttl)
+    await redis_client.set(state_key(user_id), encode(state), ex=ttl)
 
 async def get_gallery_state(user_id: int):
-    key = f"gallery_state:{user_id}"
-    cached = await redis_client.get(key)
-    if cached:
-        return json.loads(cached)
-    return None
+    return decode(await redis_client.get(state_key(user_id)))
+
+async def get_gallery_bundle(user_id: int, query: str, settings: dict, pages: list):
+    # Состояние пользователя и страницы поиска за один проход по сети
+    async with redis_client.pipeline(transaction=False) as pipe:
+        pipe.get(state_key(user_id))
+        pipe.mget([search_key(query, settings, page) for page in pages])
+        state, values = await pipe.execute()
+    return decode(state), [decode(value) for value in values]
+
+# ------ Битовые карты (фильтр уже показанных фото) ------
+async def get_bitmaps(keys: list) -> list:
+    # Карты читаются целиком одним MGET, биты проверяются на стороне бота
+    return await redis_client.mget(keys)
+
+async def set_bits(bits: dict, ttl: int):
+    # bits: ключ -> номера битов
+    async with redis_client.pipeline(transaction=False) as pipe:
+        for key, offsets in bits.items():
+            for offset in offsets:
+                pipe.setbit(key, offset, 1)
+            pipe.expire(key, ttl)
+        await pipe.execute()
+
+# ------ Блокировки между воркерами ------
+# Снимаем только свою блокировку: чужую (наша истекла и её перехватили) не трогаем
+_release_lock = redis_client.register_script(
+    "if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('del', KEYS[1]) end return 0"
+)
+
+async def acquire_lock(key: str, token: str, ttl_ms: int) -> bool:
+    return bool(await redis_client.set(key, token, nx=True, px=ttl_ms))
+
+async def release_lock(key: str, token: str):
+    await _release_lock(keys=[key], args=[token])
+
+# ------ Сброс кэшей БД между воркерами ------
+async def publish_invalidation(message: dict):
+    await redis_client.publish(INVALIDATION_CHANNEL, encode(message))
+
+async def invalidation_messages():
+    """Сообщения о сбросе кэша от всех воркеров, пока соединение живо."""
+    pubsub = redis_client.pubsub(ignore_subscribe_messages=True)
+    try:
+        await pubsub.subscribe(INVALIDATION_CHANNEL)
+        while True:
+            # Ждём меньше socket_timeout, иначе тишина в канале выглядит как обрыв
+            message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+            if message is not None and message["type"] == "message":
+                yield decode(message["data"])
+    finally:
+        await pubsub.aclose()
+
+async def close():
+    await redis_client.aclose()
+    await pool.disconnect()
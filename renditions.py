@@ -0,0 +1,33 @@
+from urllib.parse import urlencode
+
+# Размеры под конкретное использование; строятся из urls.raw параметрами imgix (динамический ресайз Unsplash).
+# Формат — JPEG: sendPhoto по URL надёжно принимает только его
+THUMB = "thumb"        # миниатюры альбома галереи, листа-сетки и inline-результатов
+PREVIEW = "preview"    # фото в чате: случайное, выбранное из галереи, inline
+DAILY = "daily"        # фото дня в рассылке
+ORIGINAL = "original"  # файл для «Скачать» — оригинал без пережатия
+
+RENDITIONS = {
+    THUMB: {"w": 200, "dpr": 2, "q": 70, "fm": "jpg", "fit": "max"},
+    PREVIEW: {"w": 1280, "dpr": 1, "q": 80, "fm": "jpg", "fit": "max"},
+    DAILY: {"w": 1600, "dpr": 1, "q": 82, "fm": "jpg", "fit": "max"},
+}
+
+# Записи без raw (сохранённые старой версией) обходятся готовыми ссылками Unsplash
+_LEGACY_FIELDS = {
+    THUMB: ("small", "regular"),
+    PREVIEW: ("regular", "full"),
+    DAILY: ("regular", "full"),
+    ORIGINAL: ("full", "raw"),
+}
+
+def url(photo, rendition: str):
+    """Ссылка на фото в нужном размере; None, если у записи нет подходящих ссылок."""
+    if rendition != ORIGINAL and photo.raw:
+        separator = "&" if "?" in photo.raw else "?"
+        return photo.raw + separator + urlencode(RENDITIONS[rendition])
+    for field in _LEGACY_FIELDS[rendition]:
+        value = getattr(photo, field)
+        if value:
+            return value
+    return None
@@ -0,0 +1,149 @@
+import asyncio
+import logging
+import time
+import redis_client
+import user_state
+from unsplash_client import search_photos
+from unsplash_scheduler import Priority
+from utils.lru import LRUCache
+from models import SearchPage
+import metrics
+from config import (
+    SEARCH_CACHE_LOCAL_SIZE,
+    SEARCH_CACHE_LOCAL_TTL,
+    SEARCH_CACHE_REDIS_TTL,
+    SEARCH_CACHE_FRESH_TTL,
+)
+
+logger = logging.getLogger(__name__)
+
+PER_PAGE = 10
+
+# Первый уровень — в памяти процесса (объекты SearchPage), второй — Redis (SearchPage.to_dict)
+_local = LRUCache(SEARCH_CACHE_LOCAL_SIZE, ttl=SEARCH_CACHE_LOCAL_TTL)
+# Страницы, которые уже предзагружаются в фоне
+_prefetching = {}
+# Устаревшие страницы, которые сейчас обновляются в фоне
+_refreshing = {}
+
+def normalize_query(query: str) -> str:
+    return " ".join(query.lower().split())
+
+def search_params(settings: dict) -> dict:
+    params = {}
+    if settings.get("orientation", "any") != "any":
+        params["orientation"] = settings["orientation"]
+    if settings.get("color", "any") != "any":
+        params["color"] = settings["color"]
+    if settings.get("order_by", "relevant"):
+        params["order_by"] = settings["order_by"]
+    return params
+
+def _local_key(query: str, params: dict, page: int) -> tuple:
+    return (query, tuple(sorted(params.items())), page)
+
+def _is_fresh(page: SearchPage) -> bool:
+    return time.time() - page.fetched_at < SEARCH_CACHE_FRESH_TTL
+
+async def _fetch_and_store(query: str, params: dict, page: int, priority: Priority):
+    response = await search_photos(query, page=page, per_page=PER_PAGE, priority=priority, **params)
+    if response is None:
+        return None
+    # Ответ API разбираем один раз: дальше живут только компактные записи
+    results = SearchPage.from_api(response)
+    _local.set(_local_key(query, params, page), results)
+    try:
+        await redis_client.cache_search_results(query, params, page, results.to_dict(), ttl=SEARCH_CACHE_REDIS_TTL)
+    except Exception as e:
+        logger.warning(f"Redis недоступен при записи кэша поиска: {e}")
+    return results
+
+def _revalidate(query: str, params: dict, page: int):
+    # Устаревшая страница уже отдана пользователю; свежая грузится в фоне из свободной квоты.
+    # Если Unsplash недоступен, старая копия продолжает обслуживать запросы до предельного TTL
+    key = _local_key(query, params, page)
+    if key in _refreshing:
+        return
+    task = asyncio.create_task(_fetch_and_store(query, params, page, Priority.GALLERY_PREFETCH))
+    _refreshing[key] = task
+    task.add_done_callback(lambda _: _refreshing.pop(key, None))
+
+async def get_search_page(query: str, page: int, settings: dict, priority: Priority = Priority.INTERACTIVE,
+                          preloaded: list = None):
+    # preloaded — уже прочитанные из Redis [страница, следующая] (см. get_state_and_pages)
+    query = normalize_query(query)
+    params = search_params(settings)
+    key = _local_key(query, params, page)
+    results = _local.get(key)
+    if results is not None:
+        metrics.cache_hit("search_local")
+        if not _is_fresh(results):
+            _revalidate(query, params, page)
+        return results
+    metrics.cache_miss("search_local")
+    pending = _prefetching.get(key)
+    if pending is not None and priority == Priority.INTERACTIVE:
+        # Страница уже грузится в фоне — дожидаемся её, а не идём в API второй раз
+        results = await asyncio.shield(pending)
+        if results is not None:
+            return results
+    if preloaded is not None:
+        cached, cached_next = preloaded
+    else:
+        try:
+            # Заодно забираем следующую страницу: «Следующая ▶» тогда не пойдёт даже в Redis
+            cached, cached_next = await redis_client.get_search_pages(query, params, [page, page + 1])
+        except Exception as e:
+            logger.warning(f"Redis недоступен при чтении кэша поиска: {e}")
+            cached = cached_next = None
+    if cached_next is not None:
+        _local.set(_local_key(query, params, page + 1), SearchPage.from_dict(cached_next))
+    results = SearchPage.from_dict(cached) if cached is not None else None
+    if results is not None:
+        metrics.cache_hit("search_redis")
+        _local.set(key, results)
+        if not _is_fresh(results):
+            _revalidate(query, params, page)
+        return results
+    metrics.cache_miss("search_redis")
+    return await _fetch_and_store(query, params, page, priority)
+
+async def get_state_and_pages(user_id: int, query: str, page: int, settings: dict):
+    """Состояние галереи пользователя и кэш страницы поиска одним конвейером Redis.
+
+    Возвращает (state, preloaded) для get_search_page; если страница уже есть в памяти
+    или Redis недоступен, preloaded — None и читается только состояние.
+    """
+    query = normalize_query(query)
+    params = search_params(settings)
+    key = _local_key(query, params, page)
+    if key in _local or key in _prefetching:
+        return await user_state.get_state(user_id), None
+    try:
+        state, preloaded = await redis_client.get_gallery_bundle(user_id, query, params, [page, page + 1])
+    except Exception as e:
+        logger.warning(f"Redis недоступен при чтении галереи {user_id}: {e}")
+        return await user_state.get_state(user_id), None
+    return state or {}, preloaded
+
+def prefetch_page(query: str, page: int, settings: dict):
+    # Следующая страница грузится в фоне, пока пользователь смотрит текущую
+    query = normalize_query(query)
+    key = _local_key(query, search_params(settings), page)
+    if key in _local or key in _prefetching:
+        return
+    task = asyncio.create_task(get_search_page(query, page, settings, priority=Priority.GALLERY_PREFETCH))
+    _prefetching[key] = task
+    task.add_done_callback(lambda _: _prefetching.pop(key, None))
+
+def snapshot() -> list:
+    return [
+        {"query": query, "params": list(params), "page": page, "results": results.to_dict(), "ttl": ttl}
+        for (query, params, page), results, ttl in _local.items()
+    ]
+
+def restore(entries: list) -> int:
+    for entry in entries:
+        key = _local_key(entry["query"], dict(entry["params"]), entry["page"])
+        _local.set(key, SearchPage.from_dict(entry["results"]), ttl=entry["ttl"])
+    return len(entries)
@@ -0,0 +1,77 @@
+import hashlib
+import logging
+import time
+import redis_client
+from config import SEEN_FILTER_BITS, SEEN_FILTER_HASHES, SEEN_FILTER_ROTATE_DAYS
+
+logger = logging.getLogger(__name__)
+
+ROTATE_SECONDS = SEEN_FILTER_ROTATE_DAYS * 86400
+# Предыдущее поколение должно дожить до конца текущего
+KEY_TTL = 2 * ROTATE_SECONDS
+
+def _generation(now: float = None) -> int:
+    return int((now or time.time()) // ROTATE_SECONDS)
+
+def _positions(photo_id: str) -> list:
+    # Двойное хэширование: k позиций из двух 64-битных половин одного дайджеста
+    digest = hashlib.blake2b(photo_id.encode("utf-8"), digest_size=16).digest()
+    h1 = int.from_bytes(digest[:8], "big")
+    h2 = int.from_bytes(digest[8:], "big") | 1
+    return [(h1 + i * h2) % SEEN_FILTER_BITS for i in range(SEEN_FILTER_HASHES)]
+
+def _bit(bitmap: bytes, offset: int) -> bool:
+    # Порядок битов как у SETBIT: бит 0 — старший бит первого байта
+    index = offset >> 3
+    return index < len(bitmap) and bool(bitmap[index] & (0x80 >> (offset & 7)))
+
+class SeenFilter:
+    """Фото, уже показанные пользователю: текущее и предыдущее поколение фильтра Блума.
+
+    Ложные срабатывания возможны (фото изредка сочтётся показанным), пропусков нет.
+    """
+
+    __slots__ = ("bitmaps",)
+
+    def __init__(self, bitmaps: tuple = ()):
+        self.bitmaps = [bitmap for bitmap in bitmaps if bitmap]
+
+    def __contains__(self, photo_id: str) -> bool:
+        if not self.bitmaps:
+            return False
+        positions = _positions(photo_id)
+        return any(all(_bit(bitmap, offset) for offset in positions) for bitmap in self.bitmaps)
+
+async def load_many(user_ids: list) -> dict:
+    """Фильтры пользователей одним MGET; при недоступном Redis все фото считаются новыми."""
+    generation = _generation()
+    keys = []
+    for user_id in user_ids:
+        keys += [redis_client.seen_key(user_id, generation), redis_client.seen_key(user_id, generation - 1)]
+    try:
+        values = await redis_client.get_bitmaps(keys) if keys else []
+    except Exception as e:
+        logger.warning(f"Redis недоступен при чтении фильтра показанных фото: {e}")
+        values = [None] * len(keys)
+    return {user_id: SeenFilter(tuple(values[2 * i:2 * i + 2])) for i, user_id in enumerate(user_ids)}
+
+async def load(user_id: int) -> SeenFilter:
+    return (await load_many([user_id]))[user_id]
+
+async def mark_many(seen: dict):
+    # seen: user_id -> id показанных фото; пишется только в текущее поколение
+    generation = _generation()
+    bits = {}
+    for user_id, photo_ids in seen.items():
+        offsets = {offset for photo_id in photo_ids for offset in _positions(photo_id)}
+        if offsets:
+            bits[redis_client.seen_key(user_id, generation)] = sorted(offsets)
+    if not bits:
+        return
+    try:
+        await redis_client.set_bits(bits, KEY_TTL)
+    except Exception as e:
+        logger.warning(f"Redis недоступен при записи фильтра показанных фото: {e}")
+
+async def mark(user_id: int, photo_id: str):
+    await mark_many({user_id: [photo_id]})
@@ -0,0 +1,111 @@
+from telegram import InlineKeyboardMarkup, InlineKeyboardButton
+from telegram.error import BadRequest
+import database
+
+# Версия протокола callback_data настроек: «s1:<поле>[:<номер варианта>]», «s1:m» — меню, «s1:r» — сброс.
+# Номера вариантов привязаны к версии: при изменении списков ниже версию нужно поднять
+VERSION = "s1"
+
+DEFAULT_SETTINGS = {
+    "orientation": "any",
+    "color": "any",
+    "order_by": "relevant"
+}
+
+# код поля -> (ключ настройки, варианты, заголовок списка, имя в старом протоколе)
+FIELDS = {
+    "o": ("orientation", ("any", "landscape", "portrait", "squarish"), "Выберите ориентацию:", "orientation"),
+    "c": ("color", ("any", "black_and_white", "black", "white", "yellow", "orange", "red", "purple", "magenta",
+                    "green", "teal", "blue"), "Выберите цвет:", "color"),
+    "b": ("order_by", ("relevant", "latest"), "Выберите порядок сортировки:", "order"),
+}
+
+MENU_TEXT = "Настройки поиска:"
+
+def callback_data(*parts: str) -> str:
+    return ":".join((VERSION,) + parts)
+
+def _options_keyboard(code: str, selected: str) -> InlineKeyboardMarkup:
+    _, options, _, _ = FIELDS[code]
+    rows = [
+        [InlineKeyboardButton(option + (" ✅" if option == selected else ""), callback_data=callback_data(code, str(i)))]
+        for i, option in enumerate(options)
+    ]
+    rows.append([InlineKeyboardButton("Назад", callback_data=callback_data("m"))])
+    return InlineKeyboardMarkup(rows)
+
+# Все клавиатуры строятся один раз: меню не зависит от настроек, списки — по одной на выбранный вариант
+MENU_KEYBOARD = InlineKeyboardMarkup([
+    [InlineKeyboardButton("Изменить ориентацию", callback_data=callback_data("o"))],
+    [InlineKeyboardButton("Изменить цвет", callback_data=callback_data("c"))],
+    [InlineKeyboardButton("Изменить сортировку", callback_data=callback_data("b"))],
+    [InlineKeyboardButton("Сбросить настройки", callback_data=callback_data("r"))],
+    [InlineKeyboardButton("Назад", callback_data="back_to_menu")]
+])
+OPTION_KEYBOARDS = {
+    (code, option): _options_keyboard(code, option)
+    for code, (_, options, _, _) in FIELDS.items() for option in options
+}
+
+# callback_data старого протокола (кнопки в уже отправленных сообщениях) -> новые
+LEGACY = {
+    "settings_main": callback_data("m"),
+    "settings_back": callback_data("m"),
+    "reset_settings": callback_data("r"),
+}
+for _code, (_, _options, _, _legacy_name) in FIELDS.items():
+    LEGACY[f"settings_{_legacy_name}"] = callback_data(_code)
+    for _i, _option in enumerate(_options):
+        LEGACY[f"set_{_legacy_name}:{_option}"] = callback_data(_code, str(_i))
+
+def is_settings_callback(data: str) -> bool:
+    return data in LEGACY or data.startswith(VERSION + ":")
+
+# ------ Действия ------
+async def _show_menu(query, user_id: int, code: str, args: list):
+    await query.message.edit_text(MENU_TEXT, reply_markup=MENU_KEYBOARD)
+
+async def _reset(query, user_id: int, code: str, args: list):
+    settings = await database.get_user_settings(user_id)
+    # Пустые настройки и так означают значения по умолчанию
+    if settings and settings != DEFAULT_SETTINGS:
+        await database.set_user_settings(user_id, DEFAULT_SETTINGS)
+    await query.message.edit_text("Настройки сброшены.", reply_markup=MENU_KEYBOARD)
+
+async def _field(query, user_id: int, code: str, args: list):
+    field, options, title, _ = FIELDS[code]
+    settings = await database.get_user_settings(user_id)
+    current = settings.get(field, DEFAULT_SETTINGS[field])
+    if not args:
+        keyboard = OPTION_KEYBOARDS.get((code, current)) or _options_keyboard(code, current)
+        await query.message.edit_text(title, reply_markup=keyboard)
+        return
+    if not args[0].isdigit() or int(args[0]) >= len(options):
+        return
+    value = options[int(args[0])]
+    # Пишем только изменение; повторный выбор того же варианта просто возвращает в меню
+    if value != current:
+        settings[field] = value
+        await database.set_user_settings(user_id, settings)
+    await query.message.edit_text("Настройки обновлены.", reply_markup=MENU_KEYBOARD)
+
+ACTIONS = {
+    "m": _show_menu,
+    "r": _reset,
+    "o": _field,
+    "c": _field,
+    "b": _field,
+}
+
+async def handle(query):
+    """Разбирает callback_data настроек (новую или старую) и вызывает действие из ACTIONS."""
+    parts = LEGACY.get(query.data, query.data).split(":")
+    action = ACTIONS.get(parts[1]) if len(parts) > 1 and parts[0] == VERSION else None
+    if action is None:
+        return
+    try:
+        await action(query, query.from_user.id, parts[1], parts[2:])
+    except BadRequest as e:
+        # Повторное нажатие той же кнопки: текст и клавиатура не изменились
+        if "not modified" not in str(e):
+            raise
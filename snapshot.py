@@ -0,0 +1,70 @@
+import json
+import logging
+import os
+import time
+import search_cache
+import user_state
+from config import SNAPSHOT_PATH, SNAPSHOT_POOL_TTL
+
+logger = logging.getLogger(__name__)
+
+VERSION = 1
+
+def _alive(entries: list, elapsed: float) -> list:
+    # Оставшиеся TTL записаны на момент остановки; время простоя вычитаем
+    result = []
+    for entry in entries:
+        if entry["ttl"] is not None:
+            entry["ttl"] -= elapsed
+            if entry["ttl"] <= 0:
+                continue
+        result.append(entry)
+    return result
+
+def save(pools):
+    """Пишет снимок пулов случайных фото, кэша поиска и локального состояния пользователей.
+
+    Индекс дискового буфера изображений сохраняет сам buffer_manager (save_index) рядом с файлами.
+    """
+    data = {
+        "version": VERSION,
+        "saved_at": time.time(),
+        "pools": pools.snapshot(),
+        "search": search_cache.snapshot(),
+        "user_state": user_state.snapshot(),
+    }
+    os.makedirs(os.path.dirname(SNAPSHOT_PATH) or ".", exist_ok=True)
+    tmp_path = f"{SNAPSHOT_PATH}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, separators=(",", ":"))
+    os.replace(tmp_path, SNAPSHOT_PATH)
+    logger.info(
+        f"Снимок сохранён: {len(data['pools'])} пулов, {len(data['search'])} страниц поиска, "
+        f"{len(data['user_state'])} состояний"
+    )
+
+def restore(pools):
+    """Читает снимок при старте; отсутствующий или повреждённый снимок означает холодный старт."""
+    try:
+        with open(SNAPSHOT_PATH, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except FileNotFoundError:
+        return
+    except Exception as e:
+        logger.warning(f"Снимок повреждён, начинаем с пустых кэшей: {e}")
+        return
+    if data.get("version") != VERSION:
+        logger.info(f"Снимок другой версии ({data.get('version')}), пропускаем")
+        return
+    elapsed = max(0.0, time.time() - data.get("saved_at", 0))
+    try:
+        photos = pools.restore(data.get("pools", []), SNAPSHOT_POOL_TTL)
+        pages = search_cache.restore(_alive(data.get("search", []), elapsed))
+        states = user_state.restore(_alive(data.get("user_state", []), elapsed))
+    except Exception as e:
+        logger.warning(f"Не удалось восстановить снимок: {e}")
+        return
+    logger.info(
+        f"Снимок {elapsed:.0f} с давности восстановлен: {photos} фото в пулах, "
+        f"{pages} страниц поиска, {states} состояний"
+    )
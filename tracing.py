@@ -0,0 +1,60 @@
+import contextvars
+import logging
+import time
+from contextlib import contextmanager
+from config import DIAGNOSTICS_ENABLED, TRACE_SLOW_UPDATE
+
+logger = logging.getLogger(__name__)
+
+# Трасса апдейта, который обрабатывает текущая задача
+_current = contextvars.ContextVar("update_trace", default=None)
+# Трассы выполняющихся сейчас апдейтов (их читает сторож зависаний из своего потока)
+active = {}
+
+class Trace:
+    """Вызовы Unsplash, Telegram и БД, сделанные при обработке одного апдейта."""
+
+    __slots__ = ("update_id", "handler", "started", "spans")
+
+    def __init__(self, update_id, handler: str):
+        self.update_id = update_id
+        self.handler = handler
+        self.started = time.perf_counter()
+        # (вид, имя, начало от старта апдейта, длительность)
+        self.spans = []
+
+    def summary(self) -> str:
+        total = time.perf_counter() - self.started
+        parts = [f"{kind} {name} +{offset * 1000:.0f}мс {duration * 1000:.0f}мс"
+                 for kind, name, offset, duration in self.spans]
+        return f"апдейт {self.update_id} {self.handler} {total * 1000:.0f}мс: " + (", ".join(parts) or "без вызовов")
+
+@contextmanager
+def span(kind: str, name: str):
+    trace = _current.get()
+    if trace is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace.spans.append((kind, name, started - trace.started, time.perf_counter() - started))
+
+@contextmanager
+def trace_update(handler: str, update):
+    if not DIAGNOSTICS_ENABLED:
+        yield None
+        return
+    trace = Trace(getattr(update, "update_id", None), handler)
+    token = _current.set(trace)
+    active[id(trace)] = trace
+    try:
+        yield trace
+    finally:
+        _current.reset(token)
+        del active[id(trace)]
+        if time.perf_counter() - trace.started >= TRACE_SLOW_UPDATE:
+            logger.warning(f"Медленный {trace.summary()}")
+        else:
+            logger.debug(trace.summary())
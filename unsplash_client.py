@@ -1,29 +1,144 @@
-import httpx
+import asyncio
 import logging
-from config import UNSPLASH_ACCESS_KEY
+import time
+import metrics
+import tracing
+from config import (
+    UNSPLASH_ACCESS_KEY,
+    UNSPLASH_RANDOM_TIMEOUT,
+    UNSPLASH_SEARCH_TIMEOUT,
+    UNSPLASH_BREAKER_FAILURES,
+    UNSPLASH_BREAKER_RESET,
+    UNSPLASH_HEDGE_DELAY,
+)
+from http_client import get_client
+from resilience import CircuitBreaker, hedged
+from unsplash_scheduler import scheduler, Priority
 
 BASE_URL = "https://api.unsplash.com"
 
-async def get_random_photo(query: str = None, **extra_params):
-    url = f"{BASE_URL}/photos/random"
-    params = {}
-    if query:
-        params["query"] = query
-    params.update(extra_params)
+# Предельное время запроса по эндпоинтам: дольше ждать нет смысла, пользователю лучше отдать кэш
+ENDPOINT_TIMEOUTS = {
+    "photos/random": UNSPLASH_RANDOM_TIMEOUT,
+    "search/photos": UNSPLASH_SEARCH_TIMEOUT,
+}
+DEFAULT_TIMEOUT = max(ENDPOINT_TIMEOUTS.values())
+
+# Одинаковые запросы в процессе: ключ -> (Task, приоритет)
+_inflight = {}
+# Автоматы размыкания по эндпоинтам
+_breakers = {}
+
+class UpstreamError(Exception):
+    """Ответ 5xx: Unsplash сам неисправен, в отличие от ошибок запроса и квоты (4xx)."""
+
+    def __init__(self, response):
+        super().__init__(f"{response.status_code} {response.text[:200]}")
+        self.response = response
+
+def get_breaker(endpoint: str) -> CircuitBreaker:
+    breaker = _breakers.get(endpoint)
+    if breaker is None:
+        breaker = CircuitBreaker(f"unsplash:{endpoint}", UNSPLASH_BREAKER_FAILURES, UNSPLASH_BREAKER_RESET)
+        _breakers[endpoint] = breaker
+    return breaker
+
+async def _fetch(url: str, params: dict, headers: dict):
+    response = await get_client().get(url, params=params, headers=headers)
+    if response.status_code >= 500:
+        raise UpstreamError(response)
+    return response
+
+async def _get(url: str, params: dict, priority: Priority, name: str):
+    endpoint = url[len(BASE_URL) + 1:]
+    breaker = get_breaker(endpoint)
+    # Пока цепь разомкнута, не ждём таймаута: вызывающий сразу отдаёт данные из кэша
+    if not breaker.allow():
+        metrics.UNSPLASH_REQUESTS.labels(endpoint=endpoint, status="circuit_open").inc()
+        return None
+    try:
+        granted = await scheduler.acquire(priority)
+    except BaseException:
+        # Отмена в очереди за квотой: в half-open иначе проба осталась бы занятой навсегда
+        breaker.abandon()
+        raise
+    if not granted:
+        breaker.abandon()
+        logging.warning(f"{name}: запрос с приоритетом {priority.name} отложен — мало квоты Unsplash")
+        return None
     headers = {"Authorization": f"Client-ID {UNSPLASH_ACCESS_KEY}"}
+    timeout = ENDPOINT_TIMEOUTS.get(endpoint, DEFAULT_TIMEOUT)
+    response = None
+    recorded = False
+    started = time.perf_counter()
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.get(url, params=params, headers=headers)
+        call = lambda: _fetch(url, params, headers)  # noqa: E731
+        # Дубль отправляем только для интерактивных запросов и только из свободной квоты
+        with tracing.span("unsplash", endpoint):
+            if priority == Priority.INTERACTIVE and UNSPLASH_HEDGE_DELAY > 0 and scheduler.budget_ok(Priority.GALLERY_PREFETCH):
+                response = await asyncio.wait_for(hedged(call, UNSPLASH_HEDGE_DELAY), timeout)
+            else:
+                response = await asyncio.wait_for(call(), timeout)
+        breaker.record_success()
+        recorded = True
+        metrics.UNSPLASH_REQUESTS.labels(endpoint=endpoint, status=str(response.status_code)).inc()
         if response.status_code == 200:
             return response.json()
         else:
             logging.error(f"Unsplash API error: {response.status_code} {response.text}")
             return None
+    except UpstreamError as e:
+        breaker.record_failure()
+        recorded = True
+        response = e.response
+        metrics.UNSPLASH_REQUESTS.labels(endpoint=endpoint, status=str(response.status_code)).inc()
+        logging.error(f"Unsplash API error in {name}: {e}")
+        return None
     except Exception as e:
-        logging.error(f"Exception in get_random_photo: {e}")
+        # Таймауты и сетевые ошибки считаются сбоем Unsplash; разбор ответа — нет
+        if not recorded:
+            breaker.record_failure()
+            recorded = True
+        metrics.UNSPLASH_REQUESTS.labels(endpoint=endpoint, status=type(e).__name__).inc()
+        logging.error(f"Exception in {name}: {e}")
         return None
+    finally:
+        if not recorded:
+            breaker.abandon()
+        metrics.UNSPLASH_LATENCY.labels(endpoint=endpoint).observe(time.perf_counter() - started)
+        scheduler.release(response.headers if response is not None else None)
+
+def _request_key(url: str, params: dict) -> tuple:
+    return (url, tuple(sorted((key, str(value)) for key, value in params.items())))
 
-async def search_photos(query: str, page: int = 1, per_page: int = 10, **extra_params):
+async def _coalesced_get(url: str, params: dict, priority: Priority, name: str):
+    key = _request_key(url, params)
+    entry = _inflight.get(key)
+    if entry is not None:
+        task, leader_priority = entry
+        metrics.UNSPLASH_COALESCED.inc()
+        # shield: отмена одного ожидающего не отменяет общий запрос
+        result = await asyncio.shield(task)
+        # Запрос с низким приоритетом могли отбросить по квоте — тогда пробуем сами
+        if result is not None or priority >= leader_priority:
+            return result
+        return await _get(url, params, priority, name)
+    metrics.UNSPLASH_COALESCE_LEADERS.inc()
+    task = asyncio.ensure_future(_get(url, params, priority, name))
+    _inflight[key] = (task, priority)
+    task.add_done_callback(lambda _: _inflight.pop(key, None))
+    return await asyncio.shield(task)
+
+async def get_random_photo(query: str = None, priority: Priority = Priority.INTERACTIVE, **extra_params):
+    url = f"{BASE_URL}/photos/random"
+    params = {}
+    if query:
+        params["query"] = query
+    params.update(extra_params)
+    return await _get(url, params, priority, "get_random_photo")
+
+async def search_photos(query: str, page: int = 1, per_page: int = 10,
+                        priority: Priority = Priority.INTERACTIVE, **extra_params):
     url = f"{BASE_URL}/search/photos"
     params = {
         "query": query,
@@ -31,15 +146,16 @@ async def search_photos(query: str, page: int = 1, per_page: int = 10, **extra_p
         "per_page": per_page,
     }
     params.update(extra_params)
-    headers = {"Authorization": f"Client-ID {UNSPLASH_ACCESS_KEY}"}
-    try:
-        async with httpx.AsyncClient() as client:
-            response = await client.get(url, params=params, headers=headers)
-        if response.status_code == 200:
-            return response.json()
-        else:
-            logging.error(f"Unsplash API error: {response.status_code} {response.text}")
-            return None
-    except Exception as e:
-        logging.error(f"Exception in search_photos: {e}")
+    # Поиск детерминирован, поэтому одинаковые параллельные запросы склеиваются;
+    # /photos/random склеивать нельзя — всем достанется одно и то же фото
+    return await _coalesced_get(url, params, priority, "search_photos")
+
+async def get_random_photos(count: int, query: str = None, priority: Priority = Priority.POOL_REFILL,
+                            **extra_params):
+    # Пакетный вариант /photos/random: один запрос к API вместо count
+    photos = await get_random_photo(query=query, priority=priority, count=count, **extra_params)
+    if photos is None:
         return None
+    if isinstance(photos, dict):
+        return [photos]
+    return photos
@@ -0,0 +1,118 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from collections import Counter
+from enum import IntEnum
+from config import (
+    UNSPLASH_HOURLY_LIMIT,
+    UNSPLASH_MAX_CONCURRENCY,
+    UNSPLASH_LOW_PRIORITY_MAX_WAIT,
+)
+
+logger = logging.getLogger(__name__)
+
+# Unsplash считает лимит за скользящий час
+QUOTA_WINDOW = 3600
+BUDGET_POLL_INTERVAL = 30
+
+class Priority(IntEnum):
+    INTERACTIVE = 0
+    GALLERY_PREFETCH = 1
+    POOL_REFILL = 2
+    DAILY = 3
+
+# Доля часового лимита, которую задача оставляет более приоритетным
+RESERVE = {
+    Priority.INTERACTIVE: 0.0,
+    Priority.GALLERY_PREFETCH: 0.1,
+    Priority.POOL_REFILL: 0.2,
+    Priority.DAILY: 0.3,
+}
+# Эти задачи при нехватке бюджета сразу отбрасываются; остальные ждут
+SHEDDABLE = {Priority.GALLERY_PREFETCH, Priority.POOL_REFILL}
+
+class QuotaScheduler:
+    """Очередь запросов к Unsplash с приоритетами и учётом X-Ratelimit-Remaining."""
+
+    def __init__(self, limit: int = UNSPLASH_HOURLY_LIMIT, max_concurrency: int = UNSPLASH_MAX_CONCURRENCY,
+                 max_wait: float = UNSPLASH_LOW_PRIORITY_MAX_WAIT):
+        self.limit = limit
+        self.remaining = limit
+        self.updated_at = time.monotonic()
+        self.max_concurrency = max_concurrency
+        self.max_wait = max_wait
+        self.inflight = 0
+        self.shed = Counter()
+        self._waiters = []
+        self._seq = itertools.count()
+
+    def _refresh_window(self):
+        # Давно не видели заголовков — считаем, что часовое окно обновилось
+        if time.monotonic() - self.updated_at > QUOTA_WINDOW:
+            self.remaining = self.limit
+            self.updated_at = time.monotonic()
+
+    def budget_ok(self, priority: Priority) -> bool:
+        self._refresh_window()
+        return self.remaining - self.inflight > int(self.limit * RESERVE[priority])
+
+    async def acquire(self, priority: Priority) -> bool:
+        if not self.budget_ok(priority):
+            if priority in SHEDDABLE or priority == Priority.INTERACTIVE:
+                self.shed[priority.name] += 1
+                return False
+            deadline = time.monotonic() + self.max_wait
+            while not self.budget_ok(priority):
+                if time.monotonic() >= deadline:
+                    self.shed[priority.name] += 1
+                    return False
+                await asyncio.sleep(BUDGET_POLL_INTERVAL)
+        if self.inflight < self.max_concurrency and not self._waiters:
+            self.inflight += 1
+            return True
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (int(priority), next(self._seq), future))
+        try:
+            await future
+        except asyncio.CancelledError:
+            # Слот могли выдать одновременно с отменой — возвращаем его
+            if future.done() and not future.cancelled():
+                self.release()
+            raise
+        return True
+
+    def release(self, headers=None):
+        self.inflight -= 1
+        if headers is not None:
+            self.update_from_headers(headers)
+        self._wake()
+
+    def _wake(self):
+        while self._waiters and self.inflight < self.max_concurrency:
+            _, _, future = heapq.heappop(self._waiters)
+            if future.done():
+                continue
+            self.inflight += 1
+            future.set_result(True)
+
+    def update_from_headers(self, headers):
+        limit = headers.get("X-Ratelimit-Limit")
+        remaining = headers.get("X-Ratelimit-Remaining")
+        if limit is not None and limit.isdigit():
+            self.limit = int(limit)
+        if remaining is not None and remaining.isdigit():
+            self.remaining = int(remaining)
+            self.updated_at = time.monotonic()
+
+    def stats(self) -> dict:
+        return {
+            "queue_depth": sum(1 for _, _, future in self._waiters if not future.done()),
+            "inflight": self.inflight,
+            "remaining": self.remaining,
+            "limit": self.limit,
+            "shed": dict(self.shed),
+        }
+
+scheduler = QuotaScheduler()
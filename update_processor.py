@@ -0,0 +1,92 @@
+import asyncio
+import contextlib
+import logging
+import time
+import uuid
+from telegram.ext import BaseUpdateProcessor
+import redis_client
+from config import CHAT_LOCK_ENABLED, CHAT_LOCK_TTL, CHAT_LOCK_WAIT
+
+logger = logging.getLogger(__name__)
+
+@contextlib.asynccontextmanager
+async def shared_chat_lock(chat_id: int):
+    """Блокировка чата в Redis: апдейты одного чата на разных воркерах не идут параллельно.
+
+    Без неё два быстрых нажатия, попавшие на разные воркеры, читают и перезаписывают
+    одно состояние gst:<user>. Если Redis недоступен или блокировку не дождались
+    за CHAT_LOCK_WAIT, апдейт обрабатывается без неё.
+    """
+    if not CHAT_LOCK_ENABLED:
+        yield
+        return
+    key = redis_client.chat_lock_key(chat_id)
+    token = uuid.uuid4().hex
+    acquired = False
+    deadline = time.monotonic() + CHAT_LOCK_WAIT
+    try:
+        while not (acquired := await redis_client.acquire_lock(key, token, int(CHAT_LOCK_TTL * 1000))):
+            if time.monotonic() >= deadline:
+                logger.warning(f"Не дождались блокировки чата {chat_id}, обрабатываем без неё")
+                break
+            await asyncio.sleep(0.05)
+    except Exception as e:
+        logger.warning(f"Redis недоступен для блокировки чата {chat_id}: {e}")
+    try:
+        yield
+    finally:
+        if acquired:
+            try:
+                await redis_client.release_lock(key, token)
+            except Exception as e:
+                logger.warning(f"Не удалось снять блокировку чата {chat_id}: {e}")
+
+class PerChatUpdateProcessor(BaseUpdateProcessor):
+    """Параллельная обработка апдейтов с сохранением порядка внутри одного чата."""
+
+    def __init__(self, max_concurrent_updates: int):
+        super().__init__(max_concurrent_updates)
+        # chat_id -> [Lock, число апдейтов, ожидающих или держащих блокировку]
+        self._chat_locks = {}
+
+    @staticmethod
+    def _ordering_key(update):
+        # Inline-запросы независимы друг от друга; к тому же их отбрасывание по паузе
+        # в inline_search не сработает, если они будут ждать друг друга
+        if update.inline_query is not None:
+            return None
+        if update.effective_chat is not None:
+            return update.effective_chat.id
+        if update.effective_user is not None:
+            return update.effective_user.id
+        return None
+
+    async def process_update(self, update, coroutine):
+        # Очередь чата ждёт до общего семафора: иначе один чат, засыпающий бота нажатиями,
+        # займёт своими ожидающими апдейтами все слоты и остановит остальные чаты
+        key = self._ordering_key(update)
+        if key is None:
+            await super().process_update(update, coroutine)
+            return
+        entry = self._chat_locks.get(key)
+        if entry is None:
+            entry = self._chat_locks[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            # Сначала очередь внутри процесса, затем блокировка между воркерами:
+            # в Redis от каждого чата ждёт не больше одного апдейта на воркер
+            async with entry[0], shared_chat_lock(key):
+                await super().process_update(update, coroutine)
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._chat_locks[key]
+
+    async def do_process_update(self, update, coroutine):
+        await coroutine
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
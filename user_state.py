@@ -0,0 +1,53 @@
+import logging
+import redis_client
+from utils.lru import LRUCache
+from models import Photo
+from config import USER_STATE_TTL, USER_STATE_LOCAL_SIZE
+
+logger = logging.getLogger(__name__)
+
+# Общее хранилище состояния пользователей — Redis, чтобы апдейты одного пользователя
+# мог обработать любой из воркеров. Локальный кэш нужен как запасной вариант,
+# когда Redis недоступен: он ограничен по размеру и забывает неактивных пользователей.
+# В состоянии лежат только компактные записи Photo.to_dict(), а не полные ответы API.
+_fallback = LRUCache(USER_STATE_LOCAL_SIZE, ttl=USER_STATE_TTL, sliding=True)
+
+async def get_state(user_id: int) -> dict:
+    try:
+        state = await redis_client.get_gallery_state(user_id)
+    except Exception as e:
+        logger.warning(f"Redis недоступен при чтении состояния {user_id}: {e}")
+        state = _fallback.get(user_id)
+    return state or {}
+
+async def save_state(user_id: int, state: dict):
+    _fallback.set(user_id, state)
+    try:
+        await redis_client.cache_gallery_state(user_id, state, ttl=USER_STATE_TTL)
+    except Exception as e:
+        logger.warning(f"Redis недоступен при записи состояния {user_id}: {e}")
+
+async def update_state(user_id: int, **changes) -> dict:
+    state = await get_state(user_id)
+    state.update(changes)
+    await save_state(user_id, state)
+    return state
+
+async def get_last_photo(user_id: int):
+    data = (await get_state(user_id)).get("last_photo")
+    return Photo.from_dict(data) if data else None
+
+async def set_last_photo(user_id: int, photo: Photo):
+    await update_state(user_id, last_photo=photo.to_dict())
+
+def gallery_photos(state: dict) -> list:
+    return [Photo.from_dict(item) for item in state.get("gallery_photos") or []]
+
+def snapshot() -> list:
+    # Локальная копия нужна, только пока Redis недоступен; Redis сам переживает перезапуск
+    return [{"user_id": user_id, "state": state, "ttl": ttl} for user_id, state, ttl in _fallback.items()]
+
+def restore(entries: list) -> int:
+    for entry in entries:
+        _fallback.set(entry["user_id"], entry["state"], ttl=entry["ttl"])
+    return len(entries)
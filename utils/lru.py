@@ -0,0 +1,58 @@
+import time
+from collections import OrderedDict
+
+class LRUCache:
+    """Ограниченный по размеру LRU-кэш с необязательным временем жизни записей.
+
+    При sliding=True срок жизни продлевается при каждом чтении (истечение по простою).
+    """
+
+    def __init__(self, maxsize: int, ttl: float = None, sliding: bool = False):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.sliding = sliding
+        self._data = OrderedDict()
+
+    def get(self, key, default=None):
+        item = self._data.get(key)
+        if item is None:
+            return default
+        value, expires = item
+        now = time.monotonic()
+        if expires is not None and expires < now:
+            del self._data[key]
+            return default
+        if self.sliding and self.ttl is not None:
+            self._data[key] = (value, now + self.ttl)
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key, value, ttl: float = None):
+        ttl = ttl if ttl is not None else self.ttl
+        expires = time.monotonic() + ttl if ttl is not None else None
+        self._data[key] = (value, expires)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        item = self._data.pop(key, None)
+        return default if item is None else item[0]
+
+    def items(self) -> list:
+        """[(ключ, значение, оставшееся время жизни или None)] без истёкших записей, от старых к новым."""
+        now = time.monotonic()
+        return [
+            (key, value, None if expires is None else expires - now)
+            for key, (value, expires) in self._data.items()
+            if expires is None or expires > now
+        ]
+
+    def clear(self):
+        self._data.clear()
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def __len__(self):
+        return len(self._data)